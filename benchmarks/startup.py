@@ -0,0 +1,174 @@
+"""Startup benchmark of the container entry points.
+
+For each entry point the import time of its __main__ module and the time from starting its process to its first
+request are measured. The first request is the started callback of the application and data container and the
+inspection request of the inspection container. The benchmark exits with status 1 if a median exceeds its budget.
+
+    python benchmarks/startup.py [--runs 10] [--budget-scale 1.5] [--json]
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+from queue import Queue, Empty
+from statistics import median
+from tempfile import TemporaryDirectory
+from threading import Thread
+from time import monotonic
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = ['application_container', 'data_container', 'inspection_container']
+
+# milliseconds, the import budget covers the entry point module without interpreter startup
+BUDGETS = {
+    'application_container': {'import': 220, 'first_request': 350},
+    'data_container': {'import': 220, 'first_request': 350},
+    'inspection_container': {'import': 60, 'first_request': 200}
+}
+
+APPLICATION_CONFIG = {
+    'application_command': 'true',
+    'local_input_files': [],
+    'local_result_files': {}
+}
+
+TIMEOUT = 30
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def _record(self):
+        self.server.requests.put(monotonic())
+        length = int(self.headers.get('Content-Length', 0))
+        if length:
+            self.rfile.read(length)
+        # the worker fails after its first request, which ends the run early
+        self.send_response(500)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    do_GET = _record
+    do_POST = _record
+
+    def log_message(self, *args):
+        pass
+
+
+def _env(home_dir):
+    env = dict(os.environ)
+    env['HOME'] = home_dir
+    env['PYTHONPATH'] = os.pathsep.join([REPO_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+    return env
+
+
+def _module(entry_point):
+    return 'cc_container_worker.{}.__main__'.format(entry_point)
+
+
+def _import_time(entry_point, env):
+    """Returns the cumulative import time of the entry point module in milliseconds."""
+    module = _module(entry_point)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+        env=env, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, universal_newlines=True, check=True
+    )
+    for line in result.stderr.splitlines():
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1000
+    raise Exception('Import time of {} not found.'.format(module))
+
+
+def _first_request_time(entry_point, env, server):
+    """Returns the time from starting the entry point process to its first request in milliseconds."""
+    url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    if entry_point == 'inspection_container':
+        settings = {'inspection_url': url}
+    else:
+        settings = {
+            'callback_key': 'benchmark',
+            'container_id': 'benchmark',
+            'callback_url': url,
+            'callback_max_retries': 0,
+            'http_max_retries': 0
+        }
+    start = monotonic()
+    sp = subprocess.Popen(
+        [sys.executable, '-m', 'cc_container_worker.{}'.format(entry_point), json.dumps(settings)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        return (server.requests.get(timeout=TIMEOUT) - start) * 1000
+    except Empty:
+        raise Exception('{} did not send a request within {} seconds.'.format(entry_point, TIMEOUT))
+    finally:
+        sp.kill()
+        sp.wait()
+
+
+def run(runs):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.requests = Queue()
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    results = {}
+    try:
+        with TemporaryDirectory() as home_dir:
+            config_dir = os.path.join(home_dir, '.config', 'cc-container-worker')
+            os.makedirs(config_dir)
+            with open(os.path.join(config_dir, 'config.json'), 'w') as f:
+                json.dump(APPLICATION_CONFIG, f)
+            env = _env(home_dir)
+
+            for entry_point in ENTRY_POINTS:
+                # the first run warms up the bytecode and page caches
+                _import_time(entry_point, env)
+                _first_request_time(entry_point, env, server)
+                results[entry_point] = {
+                    'import': median([_import_time(entry_point, env) for _ in range(runs)]),
+                    'first_request': median([_first_request_time(entry_point, env, server) for _ in range(runs)])
+                }
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def over_budget(results, budget_scale=1):
+    violations = []
+    for entry_point, result in results.items():
+        for key, value in result.items():
+            budget = BUDGETS[entry_point][key] * budget_scale
+            if value > budget:
+                violations.append('{} {}: {:.1f} ms > {:.1f} ms'.format(entry_point, key, value, budget))
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup benchmark of the container entry points.')
+    parser.add_argument('--runs', type=int, default=10, help='number of measurements per entry point')
+    parser.add_argument('--budget-scale', type=float, default=1, help='factor applied to the budgets for slow hosts')
+    parser.add_argument('--json', action='store_true', help='print the medians as JSON')
+    args = parser.parse_args()
+
+    results = run(args.runs)
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        print('{:<24}{:>12}{:>20}'.format('entry point', 'import ms', 'first request ms'))
+        for entry_point, result in results.items():
+            print('{:<24}{:>12.1f}{:>20.1f}'.format(entry_point, result['import'], result['first_request']))
+
+    violations = over_budget(results, args.budget_scale)
+    for violation in violations:
+        print('over budget: {}'.format(violation), file=sys.stderr)
+    if violations:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
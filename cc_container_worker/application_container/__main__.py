@@ -1,15 +1,22 @@
 import os
 import sys
 import json
-import jsonschema
 from subprocess import Popen, PIPE
 from threading import Thread
 from traceback import format_exc
 
+from cc_container_worker.application_container.output import OutputCapture
 from cc_container_worker.application_container.telemetry import Telemetry
-from cc_container_worker.commons.data import ac_download, ac_upload, tracing_upload
+from cc_container_worker.commons.data import ac_download, submit_ac_stream, finish_ac_stream
+from cc_container_worker.commons.data import submit_ac_result_stream, finish_ac_result_stream
+from cc_container_worker.commons.data import submit_ac_upload, submit_tracing_upload, submit_file_upload
+from cc_container_worker.commons.downloaders import PART_SUFFIX, CHECKPOINT_SUFFIX
+from cc_container_worker.commons import sessions
+from cc_container_worker.commons import stats
 from cc_container_worker.commons.callbacks import CallbackHandler
-from cc_container_worker.commons.schemas import application_config_schema
+from cc_container_worker.commons.schemas import validate_application_config
+from cc_container_worker.commons.scheduler import TransferScheduler
+from cc_container_worker.commons.streaming import COMPLETE_SUFFIX
 
 CONFIG_FILE_PATH = os.path.join(os.path.expanduser('~'), '.config', 'cc-container-worker', 'config.json')
 
@@ -19,23 +26,64 @@ LOCAL_TRACING_FILE = {
     'optional': True
 }
 
+LOCAL_TELEMETRY_FILE = {
+    'dir': '/var/tmp/cc-telemetry',
+    'name': 'time_series.csv',
+    'optional': True
+}
 
-def main():
-    settings = json.loads(sys.argv[1])
-    callback_handler = CallbackHandler(settings, container_type='application')
+LOCAL_OUTPUT_FILES = {
+    'std_out': {
+        'dir': '/var/tmp/cc-output',
+        'name': 'std_out.log',
+        'optional': True
+    },
+    'std_err': {
+        'dir': '/var/tmp/cc-output',
+        'name': 'std_err.log',
+        'optional': True
+    }
+}
 
-    config = None
+
+def _terminate_on_failure(sp):
+    """Returns a callback for the futures of input streams, which terminates the application if its stream failed."""
+    def callback(future):
+        if not future.cancelled() and future.exception() is not None:
+            sp.terminate()
+    return callback
+
+
+def _capture_output(sp, output_capture):
+    """Starts reading stdout and stderr of the application. The complete output is written to the local output file
+    if the output_capture settings contain an std_out_file or std_err_file to upload it."""
+    captures = {}
+    for key, pipe in [('std_out', sp.stdout), ('std_err', sp.stderr)]:
+        log_file_path = None
+        if output_capture.get('{}_file'.format(key)):
+            local_output_file = LOCAL_OUTPUT_FILES[key]
+            if not os.path.exists(local_output_file['dir']):
+                os.makedirs(local_output_file['dir'])
+            log_file_path = os.path.join(local_output_file['dir'], local_output_file['name'])
+        captures[key] = OutputCapture(
+            pipe,
+            head_size=output_capture.get('head_size'),
+            tail_size=output_capture.get('tail_size'),
+            log_file_path=log_file_path
+        )
+        captures[key].start()
+    return captures
+
+
+def _stop_streams(stream_scheduler, stream_futures, config):
+    finish_ac_result_stream(config['local_result_files'], aborted=True)
     try:
-        with open(CONFIG_FILE_PATH) as f:
-            config = json.load(f)
-        jsonschema.validate(config, application_config_schema)
+        finish_ac_stream(stream_scheduler, stream_futures, config['local_input_files'])
     except:
-        description = 'Could not load JSON config file from path {}'.format(CONFIG_FILE_PATH)
-        callback_handler.send_callback(
-            callback_type='started', state='failed', description=description, exception=format_exc()
-        )
-        exit(3)
+        pass
+
 
+def _make_result_dirs(config):
     for key, val in config['local_result_files'].items():
         try:
             if not os.path.exists(val['dir']):
@@ -43,10 +91,24 @@ def main():
         except:
             pass
 
-    description = 'Container started.'
-    additional_settings = callback_handler.send_callback(
-        callback_type='started', state='success', description=description
-    )
+
+def _remove_task_files(config):
+    """Removes the input, result and log files of a finished task and the partial files of interrupted downloads, so
+    that they are not seen by the next task. The directories are kept, because they may contain files of the image."""
+    local_files = config['local_input_files'] + list(config['local_result_files'].values())
+    local_files += [LOCAL_TRACING_FILE, LOCAL_TELEMETRY_FILE] + list(LOCAL_OUTPUT_FILES.values())
+    for local_file in local_files:
+        local_file_path = os.path.join(local_file['dir'], local_file['name'])
+        for suffix in ['', COMPLETE_SUFFIX, PART_SUFFIX, CHECKPOINT_SUFFIX]:
+            path = local_file_path + suffix
+            if os.path.lexists(path):
+                os.remove(path)
+
+
+def _run_task(settings, config, callback_handler, additional_settings, stream_scheduler, first_task=True):
+    """Runs the task of additional_settings, which were received with a started callback. Returns the exit code of the
+    container."""
+    _make_result_dirs(config)
 
     meta_data = {
         'application_container_id': settings['container_id'],
@@ -59,21 +121,38 @@ def main():
     if len(input_files) != len(config['local_input_files']):
         description = 'Number of local_input_files in config does not match input_files.'
         callback_handler.send_callback(callback_type='files_retrieved', state='failed', description=description)
-        exit(5)
+        return 5
 
+    stream_futures = []
+    result_stream_futures = []
     try:
-        ac_download(input_files, config['local_input_files'])
+        stream_futures = submit_ac_stream(stream_scheduler, input_files, config['local_input_files'])
+        with stats.span('stage_in', files=len(input_files) - len(stream_futures)):
+            ac_download(
+                input_files,
+                config['local_input_files'],
+                max_workers=additional_settings.get('max_parallel_downloads'),
+                max_workers_per_host=additional_settings.get('max_parallel_downloads_per_host'),
+                input_cache=additional_settings.get('input_cache')
+            )
     except:
+        _stop_streams(stream_scheduler, stream_futures, config)
         description = 'Could not retrieve input files.'
         callback_handler.send_callback(
             callback_type='files_retrieved', state='failed', description=description, exception=format_exc()
         )
-        exit(6)
+        return 6
 
     description = 'Input files retrieved.'
-    callback_handler.send_callback(callback_type='files_retrieved', state='success', description=description)
+    if stream_futures:
+        description = 'Input files retrieved, {} input files are streamed.'.format(len(stream_futures))
+    callback_handler.send_callback(
+        callback_type='files_retrieved', state='success', description=description, telemetry={'spans': stats.spans()}
+    )
 
     telemetry_data = None
+    output_capture = additional_settings.get('output_capture') or {}
+    telemetry_settings = additional_settings.get('telemetry') or {}
     application_command = config['application_command']
     try:
         if additional_settings.get('parameters'):
@@ -87,6 +166,10 @@ def main():
             else:
                 raise Exception('Type of parameters not valid: {}'.format(type(additional_settings['parameters'])))
 
+        result_stream_futures = submit_ac_result_stream(
+            stream_scheduler, result_files, config['local_result_files'], meta_data
+        )
+
         preexec_fn = None
 
         if additional_settings.get('sandbox'):
@@ -100,85 +183,228 @@ def main():
                 os.makedirs(LOCAL_TRACING_FILE['dir'])
             local_tracing_file_path = os.path.join(LOCAL_TRACING_FILE['dir'], LOCAL_TRACING_FILE['name'])
             sp = Popen(application_command, stdout=PIPE, stderr=PIPE, shell=True, preexec_fn=preexec_fn)
+            for future in stream_futures:
+                future.add_done_callback(_terminate_on_failure(sp))
+            captures = _capture_output(sp, output_capture)
 
             tracing = Tracing(sp.pid, config=additional_settings.get('tracing'), outfile=local_tracing_file_path)
             tracing.start()
 
-            telemetry = Telemetry(sp, config=config)
+            telemetry = Telemetry(sp, config=config, settings=telemetry_settings, first_task=first_task)
             t = Thread(target=telemetry.monitor)
             t.start()
 
-            std_out, std_err = sp.communicate()
+            with stats.span('process'):
+                sp.wait()
+            telemetry.stop()
             tracing.finish()
         else:
             sp = Popen(application_command, stdout=PIPE, stderr=PIPE, shell=True, preexec_fn=preexec_fn)
+            for future in stream_futures:
+                future.add_done_callback(_terminate_on_failure(sp))
+            captures = _capture_output(sp, output_capture)
 
-            telemetry = Telemetry(sp, config=config)
+            telemetry = Telemetry(sp, config=config, settings=telemetry_settings, first_task=first_task)
             t = Thread(target=telemetry.monitor)
             t.start()
 
-            std_out, std_err = sp.communicate()
+            with stats.span('process'):
+                sp.wait()
+            telemetry.stop()
 
+        t.join()
+        for capture in captures.values():
+            capture.join()
         return_code = sp.returncode
 
         # Collect telemetry data
         telemetry_data = telemetry.result()
-        if std_out:
-            telemetry_data['std_out'] = str(std_out)
-        if std_err:
-            telemetry_data['std_err'] = str(std_err)
+        if not telemetry_settings.get('callback_time_series', True):
+            del telemetry_data['time_series']
+        if telemetry_settings.get('telemetry_file'):
+            if not os.path.exists(LOCAL_TELEMETRY_FILE['dir']):
+                os.makedirs(LOCAL_TELEMETRY_FILE['dir'])
+            telemetry.write_time_series(os.path.join(LOCAL_TELEMETRY_FILE['dir'], LOCAL_TELEMETRY_FILE['name']))
+        for key, capture in captures.items():
+            output = capture.output()
+            if output:
+                telemetry_data[key] = str(output)
+            telemetry_data['{}_bytes'.format(key)] = capture.num_bytes
+            if capture.log_error:
+                telemetry_data['{}_file_error'.format(key)] = capture.log_error
         telemetry_data['return_code'] = return_code
     except:
+        exception = format_exc()
+        _stop_streams(stream_scheduler, stream_futures, config)
         callback_handler.send_callback(
-            callback_type='processed', state='failed', description='Processing failed.', exception=format_exc()
+            callback_type='processed', state='failed', description='Processing failed.', exception=exception
         )
-        exit(8)
+        return 8
 
     description = 'Processing succeeded.'
     state = 'success'
     exception = None
 
-    if return_code != 0:
-        description = 'Processing failed.'
-        state = 'failed'
-
     try:
-        if additional_settings.get('tracing'):
-            tracing_file = additional_settings['tracing'].get('tracing_file')
-            if tracing_file:
-                tracing_upload(tracing_file, LOCAL_TRACING_FILE, meta_data)
+        finish_ac_stream(stream_scheduler, stream_futures, config['local_input_files'])
     except:
-        if return_code != 0:
-            description = 'Processing failed and tracing file upload failed.'
-        else:
-            description = 'Tracing file upload failed.'
+        # the application read incomplete input files, its results are not uploaded
+        description = 'Streaming input files failed.'
         state = 'failed'
         exception = format_exc()
+        return_code = return_code or 1
+
+    finish_ac_result_stream(config['local_result_files'], aborted=return_code != 0)
+
+    if return_code != 0 and state == 'success':
+        description = 'Processing failed.'
+        state = 'failed'
+
+    upload_scheduler = TransferScheduler(
+        max_workers=additional_settings.get('max_parallel_uploads'),
+        max_workers_per_key=additional_settings.get('max_parallel_uploads_per_connector')
+    )
+
+    with upload_scheduler:
+        # result files are uploaded concurrently with the tracing file and the processed callback
+        result_futures = []
+        result_exception = None
+        if return_code == 0:
+            try:
+                result_futures = submit_ac_upload(
+                    upload_scheduler, result_files, config['local_result_files'], meta_data
+                )
+            except:
+                result_exception = format_exc()
+
+        try:
+            # the tracing file, the telemetry file and the output logs are uploaded before the processed callback, also
+            # on failure
+            log_futures = []
+            if additional_settings.get('tracing'):
+                tracing_file = additional_settings['tracing'].get('tracing_file')
+                if tracing_file:
+                    log_futures += submit_tracing_upload(upload_scheduler, tracing_file, LOCAL_TRACING_FILE, meta_data)
+            if telemetry_settings.get('telemetry_file'):
+                log_futures += submit_file_upload(
+                    upload_scheduler,
+                    'telemetry_file',
+                    telemetry_settings['telemetry_file'],
+                    LOCAL_TELEMETRY_FILE,
+                    meta_data
+                )
+            log_error = None
+            for key, local_output_file in LOCAL_OUTPUT_FILES.items():
+                output_file = output_capture.get('{}_file'.format(key))
+                if output_file and captures[key].log_error:
+                    # a truncated log is not uploaded as if it was complete
+                    log_error = 'Could not write {} file: {}'.format(key, captures[key].log_error)
+                elif output_file:
+                    log_futures += submit_file_upload(
+                        upload_scheduler, '{}_file'.format(key), output_file, local_output_file, meta_data
+                    )
+            if log_futures:
+                with stats.span('log_upload', files=len(log_futures)):
+                    upload_scheduler.wait(log_futures)
+            if log_error:
+                raise Exception(log_error)
+        except:
+            if return_code != 0:
+                description = 'Processing failed and tracing, telemetry or output file upload failed.'
+            else:
+                description = 'Tracing, telemetry or output file upload failed.'
+            state = 'failed'
+            exception = format_exc()
+
+        callback_handler.send_callback(
+            callback_type='processed',
+            state=state,
+            description=description,
+            exception=exception,
+            telemetry=telemetry_data,
+        )
+
+        if return_code != 0:
+            return 9
+
+        try:
+            if result_exception:
+                raise Exception(result_exception)
+            with stats.span('stage_out', files=len(result_futures) + len(result_stream_futures)):
+                upload_scheduler.wait(result_futures)
+                stream_scheduler.wait(result_stream_futures)
+        except:
+            description = 'Could not send result files.'
+            callback_handler.send_callback(
+                callback_type='results_sent', state='failed', description=description, exception=format_exc()
+            )
+            return 10
 
     callback_handler.send_callback(
-        callback_type='processed',
-        state=state,
-        description=description,
-        exception=exception,
-        telemetry=telemetry_data,
+        callback_type='results_sent',
+        state='success',
+        description='Result files sent.',
+        telemetry={'transfers': stats.transfers(), 'spans': stats.spans()}
     )
+    return 0
 
-    if return_code != 0:
-        exit(9)
 
+def main():
+    settings = json.loads(sys.argv[1])
+    sessions.configure(
+        pool_size=settings.get('http_pool_size'),
+        max_retries=settings.get('http_max_retries'),
+        timeout=settings.get('http_timeout')
+    )
+    callback_handler = CallbackHandler(settings, container_type='application')
+
+    config = None
     try:
-        ac_upload(result_files, config['local_result_files'], meta_data)
+        with stats.span('load_config'):
+            with open(CONFIG_FILE_PATH) as f:
+                config = json.load(f)
+            validate_application_config(config)
     except:
-        description = 'Could not send result files.'
+        description = 'Could not load JSON config file from path {}'.format(CONFIG_FILE_PATH)
         callback_handler.send_callback(
-            callback_type='results_sent', state='failed', description=description, exception=format_exc()
+            callback_type='started', state='failed', description=description, exception=format_exc()
         )
-        exit(10)
+        exit(3)
 
-    callback_handler.send_callback(
-        callback_type='results_sent', state='success', description='Result files sent.'
+    description = 'Container started.'
+    additional_settings = callback_handler.send_callback(
+        callback_type='started', state='success', description=description
     )
 
+    first_task = True
+    while True:
+        # streamable input and result files are transferred while the application runs
+        num_files = len(additional_settings['input_files']) + len(additional_settings['result_files'])
+        with TransferScheduler(max_workers=num_files or None) as stream_scheduler:
+            exit_code = _run_task(
+                settings, config, callback_handler, additional_settings, stream_scheduler, first_task=first_task
+            )
+        if not settings.get('multi_task'):
+            break
+        first_task = False
+
+        # the python process, its connection pools and the input cache are reused for the next task
+        callback_handler.flush()
+        _remove_task_files(config)
+        stats.reset()
+        description = 'Container ready for the next task.'
+        additional_settings = callback_handler.send_callback(
+            callback_type='started', state='success', description=description
+        )
+        if not additional_settings or not additional_settings.get('task_id'):
+            # the task queue is empty
+            return
+
+    # delivery errors of the last callbacks must not be hidden by the exit code
+    callback_handler.flush()
+    if exit_code:
+        exit(exit_code)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,72 @@
+import os
+from threading import Thread
+
+DEFAULT_HEAD_SIZE = 32 * 1024
+DEFAULT_TAIL_SIZE = 32 * 1024
+READ_SIZE = 64 * 1024
+
+
+class OutputCapture:
+    """Reads an output pipe of the application in a background thread.
+
+    Only the first head_size and the last tail_size bytes are kept in memory. The complete output is optionally
+    written to log_file_path, which can be uploaded after the application exited.
+    """
+    def __init__(self, pipe, head_size=None, tail_size=None, log_file_path=None):
+        self.pipe = pipe
+        self.head_size = DEFAULT_HEAD_SIZE if head_size is None else head_size
+        self.tail_size = DEFAULT_TAIL_SIZE if tail_size is None else tail_size
+        self.log_file_path = log_file_path
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.num_bytes = 0
+        self.log_error = None
+        self.thread = Thread(target=self._read)
+
+    def start(self):
+        self.thread.start()
+
+    def join(self):
+        self.thread.join()
+
+    def _read(self):
+        log_file = None
+        if self.log_file_path:
+            log_file = open(self.log_file_path, 'wb')
+        try:
+            fd = self.pipe.fileno()
+            while True:
+                data = os.read(fd, READ_SIZE)
+                if not data:
+                    break
+                self.num_bytes += len(data)
+                if log_file:
+                    try:
+                        log_file.write(data)
+                    except OSError as e:
+                        # the pipe is drained anyway, otherwise the application would block
+                        self.log_error = str(e)
+                        log_file.close()
+                        log_file = None
+                self._keep(data)
+        finally:
+            if log_file:
+                log_file.close()
+            self.pipe.close()
+
+    def _keep(self, data):
+        if len(self.head) < self.head_size:
+            n = self.head_size - len(self.head)
+            self.head += data[:n]
+            data = data[n:]
+        if data and self.tail_size:
+            self.tail += data
+            if len(self.tail) > self.tail_size:
+                del self.tail[:-self.tail_size]
+
+    def output(self):
+        """Returns the kept bytes. Omitted bytes between head and tail are replaced by a marker line."""
+        omitted = self.num_bytes - len(self.head) - len(self.tail)
+        if omitted > 0:
+            return bytes(self.head) + '\n[{} bytes omitted]\n'.format(omitted).encode('utf-8') + bytes(self.tail)
+        return bytes(self.head + self.tail)
@@ -1,45 +1,163 @@
-from psutil import Process
+import os
+import resource
 from os.path import getsize, join, isfile
-from time import sleep
-from threading import Lock
+from threading import Event, Lock
 from math import ceil
-from time import time
+from time import monotonic, time
+
+from cc_container_worker.application_container.timeseries import TimeSeries, COUNTER, GAUGE
+from cc_container_worker.commons import stats
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+DEFAULT_MIN_INTERVAL = 0.1
+DEFAULT_MAX_INTERVAL = 5
+MEMORY_CHANGE_RATIO = 0.1
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+MIB = 1024 * 1024
+
+TIME_SERIES_FIELDS = [
+    ('time_ms', COUNTER),
+    ('rss_memory', GAUGE),
+    ('cpu_percent', GAUGE),
+    ('read_bytes', COUNTER),
+    ('write_bytes', COUNTER),
+    ('open_fds', GAUGE)
+]
 
 
 class Telemetry:
-    def __init__(self, process, config):
-        self.telemetry_interval_seconds = 5
+    """Samples memory, CPU time, I/O and thread counts of the application and its child processes.
+
+    The process tree is read from /proc. If the container runs in its own cgroup v2, peak memory, CPU time and I/O
+    bytes are taken from the cgroup accounting instead, which is exact and includes short spikes between samples,
+    but also covers the worker itself. The sampling interval starts at min_interval and doubles up to max_interval
+    while the memory usage is stable. Every sample is recorded in a TimeSeries of at most max_samples rows. The
+    settings are taken from the optional telemetry task settings.
+
+    The kernel only provides lifetime maxima of the waited-for processes and the cgroup, which also cover earlier
+    tasks of a multi-task container. memory.peak is therefore reset where it is writable (Linux 6.12). Otherwise
+    both maxima of later tasks are only reported if they increased during the task.
+    """
+    def __init__(self, process, config, settings=None, first_task=True):
+        settings = settings or {}
+        self.min_interval = settings.get('min_interval', DEFAULT_MIN_INTERVAL)
+        self.max_interval = settings.get('max_interval', DEFAULT_MAX_INTERVAL)
         self.process = process
         self.config = config
+        self.first_task = first_task
         self.max_vms_memory = 0
         self.max_rss_memory = 0
+        self.max_threads = 0
+        self.max_processes = 0
+        self.time_series = TimeSeries(TIME_SERIES_FIELDS, max_samples=settings.get('max_samples'))
+        self._last_cpu = (0, 0)
         self.lock = Lock()
         self.timestamp = time()
+        self._start = monotonic()
+        self._stopped = Event()
+        self._processes = {}
+        self._exited = (0, 0, 0)
+        self._rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self._cgroup_dir = _cgroup_dir()
+        self._cgroup = _read_cgroup(self._cgroup_dir) if self._cgroup_dir else None
+        self._peak_fd = _reset_peak_memory(self._cgroup_dir) if self._cgroup_dir else None
+        self._peak_memory = None
+
+    def stop(self):
+        self._stopped.set()
+        with self.lock:
+            if self._peak_fd is not None:
+                self._peak_memory = _read_reset_peak_memory(self._peak_fd)
+                self._peak_fd = None
 
     def monitor(self):
-        # source: http://stackoverflow.com/a/13607392
-        while True:
+        interval = self.min_interval
+        last_rss_memory = None
+        while not self._stopped.is_set():
             try:
-                pp = Process(self.process.pid)
-                processes = list(pp.children(recursive=True))
-                processes.append(pp)
-
-                vms_memory = 0
-                rss_memory = 0
-
-                for p in processes:
-                    try:
-                        mem_info = p.memory_info()
-                        rss_memory += mem_info[0]
-                        vms_memory += mem_info[1]
-                    except:
-                        pass
-                with self.lock:
-                    self.max_vms_memory = max(self.max_vms_memory, vms_memory)
-                    self.max_rss_memory = max(self.max_rss_memory, rss_memory)
-            except:
+                rss_memory = self._sample()
+            except ProcessLookupError:
                 break
-            sleep(self.telemetry_interval_seconds)
+            if last_rss_memory is not None \
+                    and abs(rss_memory - last_rss_memory) > MEMORY_CHANGE_RATIO * max(last_rss_memory, MIB):
+                interval = self.min_interval
+            else:
+                interval = min(interval * 2, self.max_interval)
+            last_rss_memory = rss_memory
+            self._stopped.wait(interval)
+
+    def _sample(self):
+        pids = _process_tree(self.process.pid)
+        vms_memory = 0
+        rss_memory = 0
+        threads = 0
+        open_fds = 0
+        processes = {}
+        for pid in pids:
+            s = _read_stat(pid)
+            if s is None:
+                continue
+            vms_memory += s['vms']
+            rss_memory += s['rss']
+            threads += s['threads']
+            open_fds += _count_fds(pid)
+            processes[pid] = (s['cpu'],) + _read_io(pid)
+
+        # the last values of exited processes are kept, so that the totals do not decrease
+        exited = self._exited
+        for pid, values in self._processes.items():
+            if pid not in processes:
+                exited = tuple(a + b for a, b in zip(exited, values))
+        self._exited = exited
+        self._processes = processes
+        totals = [exited[i] + sum(v[i] for v in processes.values()) for i in range(3)]
+
+        elapsed = monotonic() - self._start
+        last_elapsed, last_cpu = self._last_cpu
+        cpu_percent = 0
+        if elapsed > last_elapsed:
+            cpu_percent = 100 * (totals[0] - last_cpu) / (elapsed - last_elapsed)
+        self._last_cpu = (elapsed, totals[0])
+
+        with self.lock:
+            self.max_vms_memory = max(self.max_vms_memory, vms_memory)
+            self.max_rss_memory = max(self.max_rss_memory, rss_memory)
+            self.max_threads = max(self.max_threads, threads)
+            self.max_processes = max(self.max_processes, len(processes))
+            self.time_series.append([
+                elapsed * 1000, rss_memory, round(cpu_percent), totals[1], totals[2], open_fds
+            ])
+        return rss_memory
+
+    def _usage(self):
+        """Returns CPU time and I/O bytes since the start of the application."""
+        if self._cgroup:
+            end = _read_cgroup(self._cgroup_dir)
+            usage = {key: end[key] - self._cgroup[key] for key in ['cpu_user', 'cpu_system', 'io_read', 'io_write']}
+            usage['peak_memory'] = end['peak_memory']
+            if self._peak_memory is not None:
+                usage['peak_memory'] = self._peak_memory
+            elif not self.first_task and end['peak_memory'] is not None \
+                    and end['peak_memory'] <= self._cgroup['peak_memory']:
+                # the peak has been reached by an earlier task
+                usage['peak_memory'] = None
+            return usage
+
+        # waited-for processes are accounted exactly by the kernel, /proc samples cover the others
+        rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        io = [self._exited[i] + sum(v[i] for v in self._processes.values()) for i in [1, 2]]
+        return {
+            'cpu_user': rusage.ru_utime - self._rusage.ru_utime,
+            'cpu_system': rusage.ru_stime - self._rusage.ru_stime,
+            'io_read': io[0],
+            'io_write': io[1],
+            'peak_memory': None
+        }
+
+    def write_time_series(self, file_path):
+        with self.lock:
+            self.time_series.write_csv(file_path)
 
     def _input_file_sizes(self):
         return [_file_size(f) for f in self.config['local_input_files']]
@@ -48,16 +166,180 @@ class Telemetry:
         return {key: _file_size(f) for key, f in self.config['local_result_files'].items()}
 
     def result(self):
+        usage = self._usage()
+        # the largest waited-for process may have peaked between two samples, unless it belongs to an earlier task
+        max_rss_memory = self.max_rss_memory
+        ru_maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        if self.first_task or ru_maxrss > self._rusage.ru_maxrss:
+            max_rss_memory = max(max_rss_memory, ru_maxrss * 1024)
         with self.lock:
             return {
-                'max_vms_memory': ceil(self.max_vms_memory / (1024 * 1024)),
-                'max_rss_memory': ceil(self.max_rss_memory / (1024 * 1024)),
+                'max_vms_memory': ceil(self.max_vms_memory / MIB),
+                'max_rss_memory': ceil(max_rss_memory / MIB),
+                'peak_memory': ceil(usage['peak_memory'] / MIB) if usage['peak_memory'] else None,
+                'cpu_user_time': usage['cpu_user'],
+                'cpu_system_time': usage['cpu_system'],
+                'io_read_bytes': usage['io_read'],
+                'io_write_bytes': usage['io_write'],
+                'max_threads': self.max_threads,
+                'max_processes': self.max_processes,
+                'telemetry_source': 'cgroup' if self._cgroup else 'proc',
+                'time_series': self.time_series.encode(),
                 'input_file_sizes': self._input_file_sizes(),
                 'result_file_sizes': self._result_file_sizes(),
-                'wall_time': time() - self.timestamp
+                'wall_time': time() - self.timestamp,
+                'transfers': stats.transfers(),
+                'spans': stats.spans()
             }
 
 
+def _process_tree(pid):
+    """Returns the pids of a process and its descendants. Raises ProcessLookupError if the process does not exist."""
+    if not os.path.exists('/proc/{}'.format(pid)):
+        raise ProcessLookupError(pid)
+    if not os.path.exists('/proc/{0}/task/{0}/children'.format(pid)):
+        # the kernel does not provide the children files
+        try:
+            from psutil import Process
+            return [pid] + [p.pid for p in Process(pid).children(recursive=True)]
+        except Exception:
+            return [pid]
+
+    pids = [pid]
+    i = 0
+    while i < len(pids):
+        task_dir = '/proc/{}/task'.format(pids[i])
+        try:
+            for tid in os.listdir(task_dir):
+                with open(join(task_dir, tid, 'children')) as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            # the process or thread exited in the meantime
+            pass
+        i += 1
+    return pids
+
+
+def _read_stat(pid):
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            data = f.read()
+    except OSError:
+        return None
+    # the command name in parentheses may contain spaces
+    fields = data[data.rfind(')') + 2:].split()
+    return {
+        'cpu': (int(fields[11]) + int(fields[12])) / CLOCK_TICKS,
+        'threads': int(fields[17]),
+        'vms': int(fields[20]),
+        'rss': int(fields[21]) * PAGE_SIZE
+    }
+
+
+def _count_fds(pid):
+    try:
+        return len(os.listdir('/proc/{}/fd'.format(pid)))
+    except OSError:
+        return 0
+
+
+def _read_io(pid):
+    read_bytes = 0
+    write_bytes = 0
+    try:
+        with open('/proc/{}/io'.format(pid)) as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key == 'read_bytes':
+                    read_bytes = int(value)
+                elif key == 'write_bytes':
+                    write_bytes = int(value)
+    except OSError:
+        pass
+    return read_bytes, write_bytes
+
+
+def _cgroup_dir():
+    """Returns the cgroup v2 directory of this process if it provides memory accounting."""
+    try:
+        with open('/proc/self/cgroup') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    for line in lines:
+        hierarchy, _, path = line.split(':', 2)
+        if hierarchy == '0':
+            cgroup_dir = join(CGROUP_ROOT, path.lstrip('/'))
+            if isfile(join(cgroup_dir, 'memory.current')) and isfile(join(cgroup_dir, 'cpu.stat')):
+                return cgroup_dir
+    return None
+
+
+def _read_cgroup(cgroup_dir):
+    cpu = _read_flat_keyed(join(cgroup_dir, 'cpu.stat'))
+    io_read = 0
+    io_write = 0
+    try:
+        with open(join(cgroup_dir, 'io.stat')) as f:
+            for line in f:
+                for entry in line.split()[1:]:
+                    key, _, value = entry.partition('=')
+                    if key == 'rbytes':
+                        io_read += int(value)
+                    elif key == 'wbytes':
+                        io_write += int(value)
+    except OSError:
+        pass
+    try:
+        with open(join(cgroup_dir, 'memory.peak')) as f:
+            peak_memory = int(f.read())
+    except (OSError, ValueError):
+        # memory.peak requires Linux 5.19
+        peak_memory = None
+    return {
+        'cpu_user': cpu.get('user_usec', 0) / 1000000,
+        'cpu_system': cpu.get('system_usec', 0) / 1000000,
+        'io_read': io_read,
+        'io_write': io_write,
+        'peak_memory': peak_memory
+    }
+
+
+def _reset_peak_memory(cgroup_dir):
+    """Resets memory.peak for reads through the returned file descriptor. Returns None if it is not writable."""
+    try:
+        fd = os.open(join(cgroup_dir, 'memory.peak'), os.O_RDWR)
+    except OSError:
+        return None
+    try:
+        os.write(fd, b'reset\n')
+        return fd
+    except OSError:
+        os.close(fd)
+        return None
+
+
+def _read_reset_peak_memory(fd):
+    try:
+        return int(os.pread(fd, 64, 0))
+    except (OSError, ValueError):
+        return None
+    finally:
+        os.close(fd)
+
+
+def _read_flat_keyed(path):
+    values = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                key, _, value = line.partition(' ')
+                values[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return values
+
+
 def _file_size(f):
     result = None
     try:
@@ -0,0 +1,134 @@
+import zlib
+from array import array
+from base64 import b64decode, b64encode
+
+DEFAULT_MAX_SAMPLES = 2048
+ENCODING = 'delta-zigzag-varint-zlib-base64'
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+
+
+class TimeSeries:
+    """Integer time series with one array per field.
+
+    If max_samples is reached, neighbouring samples are merged pairwise and later samples are merged in groups of the
+    same size, so that long runs are kept at a uniform, lower resolution. Merged samples keep the last value of COUNTER
+    fields (e.g. time or cumulative bytes) and the maximum of GAUGE fields (e.g. memory), so that peaks are preserved.
+    """
+    def __init__(self, fields, max_samples=None):
+        self.fields = [name for name, _ in fields]
+        self.kinds = [kind for _, kind in fields]
+        self.max_samples = max_samples or DEFAULT_MAX_SAMPLES
+        self.columns = [array('q') for _ in fields]
+        self.stride = 1
+        self._pending = None
+        self._pending_count = 0
+
+    def __len__(self):
+        return len(self.columns[0]) + (1 if self._pending else 0)
+
+    def append(self, values):
+        values = [int(value) for value in values]
+        if self._pending:
+            values = self._merge(self._pending, values)
+        self._pending = values
+        self._pending_count += 1
+        if self._pending_count < self.stride:
+            return
+
+        for column, value in zip(self.columns, values):
+            column.append(value)
+        self._pending = None
+        self._pending_count = 0
+        if len(self.columns[0]) >= self.max_samples:
+            self._downsample()
+
+    def _merge(self, a, b):
+        return [y if kind == COUNTER else max(x, y) for x, y, kind in zip(a, b, self.kinds)]
+
+    def _downsample(self):
+        n = len(self.columns[0]) // 2 * 2
+        for i, (column, kind) in enumerate(zip(self.columns, self.kinds)):
+            if kind == COUNTER:
+                merged = array('q', column[1:n:2])
+            else:
+                merged = array('q', map(max, column[0:n:2], column[1:n:2]))
+            # an odd last sample is kept as it is
+            merged.extend(column[n:])
+            self.columns[i] = merged
+        self.stride *= 2
+
+    def rows(self):
+        rows = list(zip(*self.columns))
+        if self._pending:
+            rows.append(tuple(self._pending))
+        return rows
+
+    def encode(self):
+        """Returns the series as delta encoded, zlib compressed columns."""
+        rows = self.rows()
+        data = bytearray()
+        for i in range(len(self.fields)):
+            previous = 0
+            for row in rows:
+                _write_varint(data, _zigzag(row[i] - previous))
+                previous = row[i]
+        return {
+            'encoding': ENCODING,
+            'fields': self.fields,
+            'count': len(rows),
+            'data': b64encode(zlib.compress(bytes(data))).decode('ascii')
+        }
+
+    def write_csv(self, file_path):
+        with open(file_path, 'w') as f:
+            f.write(','.join(self.fields) + '\n')
+            for row in self.rows():
+                f.write(','.join(str(value) for value in row) + '\n')
+
+
+def decode(encoded):
+    """Returns the rows of an encoded time series."""
+    if encoded['encoding'] != ENCODING:
+        raise Exception('Time series encoding not supported: {}'.format(encoded['encoding']))
+    data = zlib.decompress(b64decode(encoded['data']))
+    count = encoded['count']
+    columns = []
+    position = 0
+    for _ in encoded['fields']:
+        column = []
+        previous = 0
+        for _ in range(count):
+            value, position = _read_varint(data, position)
+            previous += _unzigzag(value)
+            column.append(previous)
+        columns.append(column)
+    return [list(row) for row in zip(*columns)]
+
+
+def _zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value):
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+
+def _write_varint(data, value):
+    while value >= 0x80:
+        data.append(value & 0x7f | 0x80)
+        value >>= 7
+    data.append(value)
+
+
+def _read_varint(data, position):
+    result = 0
+    shift = 0
+    while True:
+        b = data[position]
+        position += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, position
+        shift += 7
@@ -1,5 +1,16 @@
+from collections import deque
+from threading import Condition, Thread
+from time import sleep
+from traceback import print_exc
+
 import requests
 
+from cc_container_worker.commons import sessions
+from cc_container_worker.commons import stats
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_FACTOR = 1
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
 
 STATES = [
     'created',
@@ -22,6 +33,13 @@ DC_CALLBACK_TYPES = [
     'files_retrieved'
 ]
 
+# these callbacks are sent in the background, their responses are not needed
+ASYNC_CALLBACK_TYPES = [
+    'files_retrieved',
+    'processed',
+    'results_sent'
+]
+
 
 def state_to_index(state):
     for i, s in enumerate(STATES):
@@ -52,34 +70,116 @@ def callback_prototype():
 
 
 class CallbackHandler:
+    """Sends callbacks to the callback_url.
+
+    started callbacks are sent synchronously, because their response contains the task settings. The other callbacks
+    are queued and delivered in order by a background thread, so that the container continues with the next phase
+    while the server is slow. A queued callback, which has not been sent yet, is replaced by a newer callback of the
+    same type. Failed deliveries are retried with exponential backoff. If a callback cannot be delivered, the queue is
+    dropped and the error is raised by the next send_callback or flush call. The thread is not a daemon, therefore
+    queued callbacks are still delivered if the container exits early.
+    """
     def __init__(self, settings, container_type):
-        self.callback = callback_prototype()
-        self.callback['callback_key'] = settings['callback_key']
-        self.callback['container_id'] = settings['container_id']
-
+        self.callback_key = settings['callback_key']
+        self.container_id = settings['container_id']
         self.callback_url = settings['callback_url']
         self.callback_type_list = DC_CALLBACK_TYPES if container_type == 'data' else AC_CALLBACK_TYPES
+        self.max_retries = settings.get('callback_max_retries', DEFAULT_MAX_RETRIES)
+        self.backoff_factor = settings.get('callback_backoff_factor', DEFAULT_BACKOFF_FACTOR)
 
-    def send_callback(self, callback_type, state, description, exception=None, telemetry=None):
+        self._condition = Condition()
+        self._queue = deque()
+        self._thread = None
+        self._error = None
 
-        self.callback['callback_type'] = callback_type_to_index(
+    def send_callback(self, callback_type, state, description, exception=None, telemetry=None):
+        callback = callback_prototype()
+        callback['callback_key'] = self.callback_key
+        callback['container_id'] = self.container_id
+        callback['callback_type'] = callback_type_to_index(
             callback_type,
             self.callback_type_list
         )
 
-        self.callback['content']['state'] = state_to_index(state)
-        self.callback['content']['description'] = description
-        self.callback['content']['exception'] = exception
-        self.callback['content']['telemetry'] = telemetry
+        callback['content']['state'] = state_to_index(state)
+        callback['content']['description'] = description
+        callback['content']['exception'] = exception
+        callback['content']['telemetry'] = telemetry
 
-        r = requests.post(
-            self.callback_url,
-            json=self.callback,
-        )
+        if callback_type in ASYNC_CALLBACK_TYPES:
+            self._enqueue(callback_type, callback)
+            return None
 
-        r.raise_for_status()
+        # callbacks must arrive in order
+        self.flush()
+        r = self._deliver(callback_type, callback)
 
         try:
             return r.json()
         except:
             pass
+
+    def flush(self):
+        """Waits until all queued callbacks have been delivered."""
+        with self._condition:
+            while self._thread is not None:
+                self._condition.wait()
+            self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise Exception('Could not deliver callback: {}'.format(self._error))
+
+    def _enqueue(self, callback_type, callback):
+        with self._condition:
+            self._raise_error()
+            if self._queue and self._queue[-1][0] == callback_type:
+                self._queue[-1] = (callback_type, callback)
+            else:
+                self._queue.append((callback_type, callback))
+            if self._thread is None:
+                self._thread = Thread(target=self._send_queued)
+                self._thread.start()
+
+    def _send_queued(self):
+        while True:
+            with self._condition:
+                if not self._queue:
+                    self._thread = None
+                    self._condition.notify_all()
+                    return
+                callback_type, callback = self._queue.popleft()
+            try:
+                self._deliver(callback_type, callback)
+            except Exception as e:
+                print_exc()
+                with self._condition:
+                    # later callbacks would be rejected by the server anyway
+                    self._error = e
+                    self._queue.clear()
+
+    def _deliver(self, callback_type, callback):
+        with stats.span('callback', callback_type=callback_type) as record:
+            retries = 0
+            while True:
+                try:
+                    # the retries of the session would multiply the retries of this loop
+                    r = sessions.session(self.callback_url, max_retries=0).post(
+                        self.callback_url,
+                        json=callback,
+                    )
+
+                    r.raise_for_status()
+                    return r
+                except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                    if retries >= self.max_retries or not _is_retryable(e):
+                        raise
+                sleep(self.backoff_factor * 2 ** retries)
+                retries += 1
+                record['retries'] = retries
+
+
+def _is_retryable(e):
+    if isinstance(e, requests.HTTPError):
+        return e.response is not None and e.response.status_code in RETRY_STATUS_CODES
+    return True
@@ -0,0 +1,127 @@
+import hashlib
+import os
+from threading import Lock
+
+READ_SIZE = 1024 * 1024
+XXHASH_ALGORITHMS = ['xxh32', 'xxh64', 'xxh3_64', 'xxh3_128', 'xxh128']
+
+
+class ChecksumMismatch(Exception):
+    pass
+
+
+class Checksum:
+    """Incremental checksum for the optional checksum field of connector_access.
+
+    The field has the form '<algorithm>:<hex digest>', e.g. 'sha256:9f86d0...'. Any hashlib algorithm (e.g. sha256,
+    md5) and the xxhash algorithms are supported, the latter require the xxhash package. Without a digest, e.g. 'md5',
+    the checksum is only computed and reported.
+    """
+    def __init__(self, spec):
+        self.spec = spec
+        algorithm, _, expected = spec.partition(':')
+        self.algorithm = algorithm.lower()
+        if self.algorithm == 'xxhash':
+            self.algorithm = 'xxh64'
+        self.expected = expected.lower() or None
+        self.reset()
+
+    def reset(self):
+        if self.algorithm in XXHASH_ALGORITHMS:
+            try:
+                import xxhash
+            except ImportError:
+                raise Exception('Checksum algorithm {} requires the xxhash package.'.format(self.algorithm))
+            self._hash = getattr(xxhash, self.algorithm)()
+        else:
+            self._hash = hashlib.new(self.algorithm)
+
+    def update(self, data):
+        self._hash.update(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def result(self):
+        return '{}:{}'.format(self.algorithm, self.hexdigest())
+
+    def verify(self, file_path):
+        if self.expected and self.expected != self.hexdigest():
+            raise ChecksumMismatch('Checksum of {} is {} instead of {}.'.format(
+                file_path, self.result(), self.spec
+            ))
+
+
+class StreamChecksum:
+    """Feeds bytes written at arbitrary offsets of a file into a Checksum in file order.
+
+    Bytes written at the current position are hashed as they arrive. Bytes written out of order, e.g. by parallel
+    segments or before a resumed download, are read back from the file by catch_up.
+    """
+    def __init__(self, checksum):
+        self.checksum = checksum
+        self.position = 0
+        self.inline_bytes = 0
+        self.lock = Lock()
+
+    def feed(self, offset, data):
+        with self.lock:
+            if offset == self.position:
+                self.checksum.update(data)
+                self.position += len(data)
+                self.inline_bytes += len(data)
+
+    def reset(self):
+        with self.lock:
+            self.checksum.reset()
+            self.position = 0
+            self.inline_bytes = 0
+
+    def catch_up(self, file_path, end):
+        """Hashes the bytes of the file from the current position up to end."""
+        with self.lock:
+            with open(file_path, 'rb') as f:
+                f.seek(self.position)
+                while self.position < end:
+                    data = f.read(min(READ_SIZE, end - self.position))
+                    if not data:
+                        break
+                    self.checksum.update(data)
+                    self.position += len(data)
+
+
+class ChecksumReader:
+    """File-like wrapper updating a Checksum with every block read, e.g. by requests or GridFS.
+
+    It can be rewound to the start, e.g. by urllib3 before a retried request, which resets the checksum.
+    """
+    def __init__(self, f, checksum):
+        self.f = f
+        self.checksum = checksum
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        if data:
+            self.checksum.update(data)
+        return data
+
+    def tell(self):
+        return self.f.tell()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        position = self.f.seek(offset, whence)
+        if position != 0:
+            raise Exception('ChecksumReader can only be rewound to the start, not to {}.'.format(position))
+        self.checksum.reset()
+        return position
+
+    def __len__(self):
+        # requests subtracts the position returned by tell
+        return os.fstat(self.f.fileno()).st_size
+
+
+def for_connector(connector_access):
+    spec = connector_access.get('checksum')
+    if not spec:
+        return None
+    return Checksum(spec)
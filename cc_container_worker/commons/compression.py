@@ -0,0 +1,188 @@
+import os
+import zlib
+from functools import partial
+from urllib.parse import urlparse
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+LZ4 = 'lz4'
+ALGORITHMS = [GZIP, ZSTD, LZ4]
+AUTO = 'auto'
+
+SUFFIXES = {
+    '.gz': GZIP,
+    '.gzip': GZIP,
+    '.zst': ZSTD,
+    '.zstd': ZSTD,
+    '.lz4': LZ4
+}
+
+# lz4 is not a registered HTTP content coding, lz4 compressed bodies are sent without Content-Encoding header
+CONTENT_ENCODINGS = {
+    GZIP: 'gzip',
+    ZSTD: 'zstd'
+}
+
+READ_SIZE = 1024 * 1024
+
+
+def _import(algorithm):
+    try:
+        if algorithm == ZSTD:
+            import zstandard
+            return zstandard
+        import lz4.frame
+        return lz4.frame
+    except ImportError:
+        package = 'zstandard' if algorithm == ZSTD else 'lz4'
+        raise Exception('Compression algorithm {} requires the {} package.'.format(algorithm, package))
+
+
+def _check(algorithm):
+    if algorithm not in ALGORITHMS:
+        raise Exception('Compression algorithm not valid: {}'.format(algorithm))
+
+
+class _Lz4Compressor:
+    def __init__(self, level):
+        self._compressor = _import(LZ4).LZ4FrameCompressor(compression_level=level or 0)
+        self._header = self._compressor.begin()
+
+    def _take_header(self):
+        header = self._header
+        self._header = b''
+        return header
+
+    def compress(self, data):
+        return self._take_header() + self._compressor.compress(data)
+
+    def flush(self):
+        return self._take_header() + self._compressor.flush()
+
+
+def compressor(algorithm, level=None):
+    """Returns an object with the compress and flush methods of zlib compression objects."""
+    _check(algorithm)
+    if algorithm == GZIP:
+        return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if level is None else level, zlib.DEFLATED, 31)
+    if algorithm == ZSTD:
+        zstandard = _import(ZSTD)
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compressobj()
+    return _Lz4Compressor(level)
+
+
+class Decompressor:
+    """Streaming decompression of concatenated gzip members or zstd and lz4 frames, e.g. of files compressed in
+    parallel with bgzip or pzstd."""
+    def __init__(self, algorithm):
+        _check(algorithm)
+        self.algorithm = algorithm
+        self.compressed_bytes = 0
+        self.num_bytes = 0
+        self._decompressor = None
+        self._new_member()
+
+    def _new_member(self):
+        if self.algorithm == GZIP:
+            self._decompressor = zlib.decompressobj(31)
+        elif self.algorithm == ZSTD:
+            self._decompressor = _import(ZSTD).ZstdDecompressor().decompressobj()
+        else:
+            self._decompressor = _import(LZ4).LZ4FrameDecompressor()
+        self._started = False
+
+    def decompress(self, data):
+        self.compressed_bytes += len(data)
+        result = []
+        while data:
+            self._started = True
+            result.append(self._decompressor.decompress(data))
+            if not self._decompressor.eof:
+                break
+            data = self._decompressor.unused_data
+            self._new_member()
+        result = b''.join(result)
+        self.num_bytes += len(result)
+        return result
+
+    def finish(self):
+        if self._started:
+            raise Exception('Compressed {} data is truncated.'.format(self.algorithm))
+
+
+def compress_blocks(blocks, algorithm, level=None, counter=None):
+    """Compresses an iterable of data blocks. The optional counter dict receives the number of raw and compressed
+    bytes."""
+    c = compressor(algorithm, level)
+    if counter is not None:
+        counter.update({'bytes': 0, 'compressed_bytes': 0})
+    for data in blocks:
+        compressed = c.compress(data)
+        if counter is not None:
+            counter['bytes'] += len(data)
+            counter['compressed_bytes'] += len(compressed)
+        if compressed:
+            yield compressed
+    compressed = c.flush()
+    if counter is not None:
+        counter['compressed_bytes'] += len(compressed)
+    if compressed:
+        yield compressed
+
+
+class CompressingReader:
+    """File-like object, which returns the compressed content of the file-like object f."""
+    def __init__(self, f, algorithm, level=None):
+        self.counter = {}
+        self._blocks = compress_blocks(iter(partial(f.read, READ_SIZE), b''), algorithm, level, self.counter)
+        self._buffer = bytearray()
+
+    def read(self, size=-1):
+        while size is None or size < 0 or len(self._buffer) < size:
+            data = next(self._blocks, None)
+            if data is None:
+                break
+            self._buffer += data
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+def algorithm_for_file(file_name):
+    return SUFFIXES.get(os.path.splitext(file_name)[1].lower())
+
+
+def url_file_name(url):
+    return os.path.basename(urlparse(url).path)
+
+
+def for_download(connector_access, source_name):
+    """Returns the algorithm selected by the optional decompress field of connector_access. With 'auto' the algorithm
+    is chosen by the file name suffix of the source, e.g. .gz or .zst."""
+    algorithm = connector_access.get('decompress')
+    if not algorithm:
+        return None
+    if algorithm == AUTO:
+        return algorithm_for_file(source_name)
+    _check(algorithm)
+    return algorithm
+
+
+def for_upload(connector_access):
+    """Returns the algorithm of the optional compression field of connector_access."""
+    algorithm = connector_access.get('compression')
+    if algorithm:
+        _check(algorithm)
+    return algorithm or None
+
+
+def decompress_file(source_path, target_path, algorithm):
+    """Decompresses a file block by block. Returns the Decompressor, which counted the bytes."""
+    d = Decompressor(algorithm)
+    with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+        for data in iter(partial(source.read, READ_SIZE), b''):
+            target.write(d.decompress(data))
+    d.finish()
+    return d
@@ -0,0 +1,59 @@
+from importlib import import_module
+from importlib.metadata import entry_points
+from inspect import getmembers, isfunction
+from threading import Lock
+
+DOWNLOADERS_GROUP = 'cc_container_worker.downloaders'
+UPLOADERS_GROUP = 'cc_container_worker.uploaders'
+
+
+class ConnectorRegistry:
+    """Maps connector types to connector functions.
+
+    The built-in connectors are the public functions defined in module_name, imported functions are ignored. Other
+    packages register connectors as entry points in the entry point group, e.g. in setup.py:
+
+        entry_points={'cc_container_worker.uploaders': ['s3 = my_package.uploaders:s3']}
+
+    Registered connectors replace built-in connectors of the same name. The built-in module is imported and the entry
+    points are discovered on first use, a registered connector is only imported when its type is requested.
+    """
+    def __init__(self, module_name, group):
+        self.module_name = module_name
+        self.group = group
+        self._lock = Lock()
+        self._connectors = None
+        self._entry_points = None
+
+    def _discover(self):
+        if self._connectors is not None:
+            return
+        module = import_module(self.module_name)
+        self._connectors = {
+            name: func for name, func in getmembers(module, isfunction)
+            if not name.startswith('_') and func.__module__ == module.__name__
+        }
+        self._entry_points = {ep.name: ep for ep in entry_points(group=self.group)}
+
+    def get(self, connector_type):
+        with self._lock:
+            self._discover()
+            ep = self._entry_points.pop(connector_type, None)
+            if ep is not None:
+                self._connectors[connector_type] = ep.load()
+            connector = self._connectors.get(connector_type)
+        if connector is None:
+            raise Exception('Connector type not supported: {}'.format(connector_type))
+        return connector
+
+    def __getitem__(self, connector_type):
+        return self.get(connector_type)
+
+    def types(self):
+        with self._lock:
+            self._discover()
+            return sorted(set(self._connectors) | set(self._entry_points))
+
+
+DOWNLOADERS = ConnectorRegistry('cc_container_worker.commons.downloaders', DOWNLOADERS_GROUP)
+UPLOADERS = ConnectorRegistry('cc_container_worker.commons.uploaders', UPLOADERS_GROUP)
@@ -1,77 +1,219 @@
 import json
 import os
-from inspect import getmembers, isfunction
+from concurrent.futures import wait
+from urllib.parse import urlparse
 from uuid import uuid4
 
-from cc_container_worker.commons import downloaders
-from cc_container_worker.commons import uploaders
+from cc_container_worker.commons import stats
+from cc_container_worker.commons import streaming
+from cc_container_worker.commons.connectors import DOWNLOADERS, UPLOADERS
+from cc_container_worker.commons.input_cache import InputCache
+from cc_container_worker.commons.scheduler import TransferScheduler
 
-try:
-    import cc_custom_downloaders
-    downloader_modules = [downloaders, cc_custom_downloaders]
-except ImportError:
-    downloader_modules = [downloaders]
+FILE_DIR = os.path.expanduser('~')
+FILES_INFO_PATH = os.path.expanduser('~/files.json')
 
-try:
-    import cc_custom_uploaders
-    uploader_modules = [uploaders, cc_custom_uploaders]
-except ImportError:
-    uploader_modules = [uploaders]
+DEFAULT_MAX_DOWNLOADS_PER_HOST = 4
 
 
-FILE_DIR = os.path.expanduser('~')
-FILES_INFO_PATH = os.path.expanduser('~/files.json')
+def _host(input_file):
+    connector_access = input_file['connector_access']
+    if connector_access.get('host'):
+        return connector_access['host']
+    if connector_access.get('url'):
+        return urlparse(connector_access['url']).netloc
+    return input_file['connector_type']
+
 
+def _timed(span_name, local_file, func, *args):
+    """Runs a transfer inside a span, which reports the size of the local file."""
+    local_file_path = os.path.join(local_file['dir'], local_file['name'])
+    with stats.span(span_name, local_file_path=local_file_path) as record:
+        func(*args)
+        if os.path.isfile(local_file_path):
+            record['bytes'] = os.path.getsize(local_file_path)
 
-def _get_functions(modules):
-    funcs = {}
-    for module in modules:
-        for name, t in getmembers(module):
-            if isfunction(t) and not name.startswith('_'):
-                funcs[name] = getattr(module, name)
-    return funcs
 
+def _download(input_files, local_input_files, max_workers, max_workers_per_host, input_cache):
+    cache = None
+    if input_cache:
+        cache = InputCache(input_cache['dir'], max_size=input_cache.get('max_size'))
 
-def dc_download(input_files, input_file_keys):
-    connectors = _get_functions(downloader_modules)
+    with TransferScheduler(
+        max_workers=max_workers,
+        max_workers_per_key=max_workers_per_host or DEFAULT_MAX_DOWNLOADS_PER_HOST
+    ) as scheduler:
+        for i, (input_file, local_input_file) in enumerate(zip(input_files, local_input_files)):
+            if streaming.stream_type(local_input_file):
+                # streamable files are downloaded by submit_ac_stream while the application runs
+                continue
+            connector = DOWNLOADERS.get(input_file['connector_type'])
+            name = 'input_files[{}]'.format(i)
+            if cache:
+                scheduler.submit(
+                    name, _host(input_file), _timed, 'download', local_input_file,
+                    cache.fetch, connector, input_file, local_input_file
+                )
+            else:
+                scheduler.submit(
+                    name, _host(input_file), _timed, 'download', local_input_file,
+                    connector, input_file['connector_access'], local_input_file
+                )
+        scheduler.wait()
+
+
+def _dc_files(input_files, input_file_keys):
     files = {}
+    local_input_files = []
     for input_file, input_file_key in zip(input_files, input_file_keys):
         local_input_file = {'dir': FILE_DIR, 'name': str(uuid4())}
         files[input_file_key] = {
             'input_file': input_file,
             'local_input_file': local_input_file
         }
-        connector = connectors[input_file['connector_type']]
-        connector(input_file['connector_access'], local_input_file)
+        local_input_files.append(local_input_file)
+    return files, local_input_files
+
+
+def _write_files_info(files):
     with open(FILES_INFO_PATH, 'w') as f:
         json.dump(files, f)
 
 
-def ac_download(input_files, local_input_files):
-    connectors = _get_functions(downloader_modules)
-    for input_file, local_input_file in zip(input_files, local_input_files):
-        connector = connectors[input_file['connector_type']]
-        connector(input_file['connector_access'], local_input_file)
+def dc_download(input_files, input_file_keys, max_workers=None, max_workers_per_host=None, input_cache=None):
+    files, local_input_files = _dc_files(input_files, input_file_keys)
+    _download(input_files, local_input_files, max_workers, max_workers_per_host, input_cache)
+
+    # the download records are exposed by the metrics endpoint of the data container
+    downloads = {record['local_file_path']: record for record in stats.transfers() if record['direction'] == 'download'}
+    for file in files.values():
+        local_input_file = file['local_input_file']
+        file['download'] = downloads.get(os.path.join(local_input_file['dir'], local_input_file['name']))
+
+    _write_files_info(files)
+
+
+def dc_lazy(input_files, input_file_keys, prefetch=False):
+    """Writes the files info, the data container downloads every file when it is requested first."""
+    files, _ = _dc_files(input_files, input_file_keys)
+    for priority, file in enumerate(files.values()):
+        file['fetch'] = {'priority': priority, 'prefetch': prefetch}
+    _write_files_info(files)
+
+
+def ac_download(input_files, local_input_files, max_workers=None, max_workers_per_host=None, input_cache=None):
+    """Downloads all input files in parallel."""
+    _download(input_files, local_input_files, max_workers, max_workers_per_host, input_cache)
+
+
+def submit_ac_stream(scheduler, input_files, local_input_files):
+    """Submits the downloads of streamable input files, which feed the application while it runs."""
+    # streams bypass the input cache and the max_parallel_downloads limits, the application may read them in any order
+    futures = []
+    for i, (input_file, local_input_file) in enumerate(zip(input_files, local_input_files)):
+        if not streaming.stream_type(local_input_file):
+            continue
+        streaming.prepare(local_input_file)
+        futures.append(scheduler.submit(
+            'input_files[{}]'.format(i),
+            None,
+            _timed,
+            'stream_download',
+            local_input_file,
+            streaming.stream,
+            DOWNLOADERS.get(input_file['connector_type']),
+            input_file,
+            local_input_file
+        ))
+    return futures
+
 
+def finish_ac_stream(scheduler, futures, local_input_files):
+    """Stops the input streams after the application exited. Raises a TransferError if a stream failed."""
+    for local_input_file in local_input_files:
+        if streaming.stream_type(local_input_file):
+            streaming.release(local_input_file)
+    wait(futures)
+    scheduler.wait(futures)
 
-def ac_upload(result_files, local_result_files, meta_data):
-    connectors = _get_functions(uploader_modules)
+
+def _upload(connector_type, connector_access, local_result_file, meta_data):
+    connector = UPLOADERS.get(connector_type)
+    _timed('upload', local_result_file, connector, connector_access, local_result_file, meta_data)
+
+
+def submit_ac_upload(scheduler, result_files, local_result_files, meta_data):
+    futures = []
+    for result_file in result_files:
+        key = result_file['local_result_file']
+        if streaming.stream_type(local_result_files[key]):
+            # streamable files are uploaded by submit_ac_result_stream while the application runs
+            continue
+        futures.append(scheduler.submit(
+            'result_files[{}]'.format(key),
+            result_file['connector_type'],
+            _upload,
+            result_file['connector_type'],
+            result_file['connector_access'],
+            local_result_files[key],
+            meta_data if result_file.get('add_meta_data') else None
+        ))
+    return futures
+
+
+def submit_ac_result_stream(scheduler, result_files, local_result_files, meta_data):
+    """Submits the uploads of streamable result files, which are completed by finish_ac_result_stream."""
+    futures = []
     for result_file in result_files:
         key = result_file['local_result_file']
         local_result_file = local_result_files[key]
-        connector = connectors[result_file['connector_type']]
-        connector(
+        if not streaming.stream_type(local_result_file):
+            continue
+        streaming.prepare(local_result_file)
+        futures.append(scheduler.submit(
+            'result_files[{}]'.format(key),
+            None,
+            _timed,
+            'stream_upload',
+            local_result_file,
+            streaming.upload,
+            UPLOADERS.get(result_file['connector_type']),
+            result_file['connector_type'],
             result_file['connector_access'],
             local_result_file,
             meta_data if result_file.get('add_meta_data') else None
-        )
+        ))
+    return futures
+
+
+def finish_ac_result_stream(local_result_files, aborted=False):
+    for local_result_file in local_result_files.values():
+        if streaming.stream_type(local_result_file):
+            streaming.finish(local_result_file, aborted=aborted)
+
+
+def submit_file_upload(scheduler, name, result_file, local_result_file, meta_data):
+    """Submits the upload of a single file produced by the worker itself, e.g. the tracing file or an output log."""
+    return [scheduler.submit(
+        name,
+        result_file['connector_type'],
+        _upload,
+        result_file['connector_type'],
+        result_file['connector_access'],
+        local_result_file,
+        meta_data if result_file.get('add_meta_data') else None
+    )]
+
+
+def submit_tracing_upload(scheduler, tracing_file, local_tracing_file, meta_data):
+    return submit_file_upload(scheduler, 'tracing_file', tracing_file, local_tracing_file, meta_data)
+
+
+def ac_upload(result_files, local_result_files, meta_data, max_workers=None, max_workers_per_connector=None):
+    with TransferScheduler(max_workers=max_workers, max_workers_per_key=max_workers_per_connector) as scheduler:
+        scheduler.wait(submit_ac_upload(scheduler, result_files, local_result_files, meta_data))
 
 
 def tracing_upload(tracing_file, local_tracing_file, meta_data):
-    connectors = _get_functions(uploader_modules)
-    connector = connectors[tracing_file['connector_type']]
-    connector(
-        tracing_file['connector_access'],
-        local_tracing_file,
-        meta_data if tracing_file.get('add_meta_data') else None
-    )
+    with TransferScheduler(max_workers=1) as scheduler:
+        scheduler.wait(submit_tracing_upload(scheduler, tracing_file, local_tracing_file, meta_data))
@@ -1,36 +1,224 @@
+import json
 import os
+from threading import Lock
+from time import monotonic, sleep
 
-import requests
-from paramiko import SSHClient, AutoAddPolicy
+from requests.exceptions import HTTPError
+from urllib3.util.request import ACCEPT_ENCODING
 
+from cc_container_worker.commons import checksums
+from cc_container_worker.commons import compression
 from cc_container_worker.commons import helper
+from cc_container_worker.commons import sessions
+from cc_container_worker.commons import ssh_connections
+from cc_container_worker.commons import stats
+from cc_container_worker.commons.scheduler import TransferScheduler, TransferError, TransferCancelled
+# private name, public functions of this module are connectors
+from cc_container_worker.commons.scheduler import check_cancelled as _check_cancelled
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_MAX_CONNECTIONS = 4
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_RETRY_BACKOFF = 1
+PART_SUFFIX = '.part'
+CHECKPOINT_SUFFIX = '.part.json'
+UNPACK_SUFFIX = '.unpack'
+CHECKPOINT_INTERVAL = 64 * 1024 * 1024
 
 
 def http(connector_access, local_input_file):
+    """Downloads a file via HTTP, in parallel segments if the server supports range requests."""
     local_file_dir = local_input_file['dir']
     local_file_name = local_input_file['name']
 
     if not os.path.exists(local_file_dir):
         os.makedirs(local_file_dir)
 
-    r = requests.get(
+    local_file_path = os.path.join(local_file_dir, local_file_name)
+    chunk_size = connector_access.get('chunk_size', DEFAULT_CHUNK_SIZE)
+    max_connections = connector_access.get('max_connections', DEFAULT_MAX_CONNECTIONS)
+    checkpoint = _Checkpoint(local_file_path, connector_access['url'], checksums.for_connector(connector_access))
+    algorithm = compression.for_download(connector_access, compression.url_file_name(connector_access['url']))
+
+    start = monotonic()
+    retries = _with_retries(
+        connector_access,
+        checkpoint,
+        lambda: _http_download(connector_access, checkpoint, chunk_size, max_connections)
+    )
+    num_segments = len(checkpoint.state['segments'])
+    checkpoint.verify()
+    checkpoint.finish(algorithm)
+
+    _record_download(local_file_path, 'http', checkpoint, retries, monotonic() - start, segments=num_segments)
+
+
+def _http_get(connector_access, headers=None, raise_for_status=True):
+    r = sessions.session(connector_access['url']).get(
         connector_access['url'],
+        headers=headers,
         auth=helper.auth(connector_access.get('auth')),
         verify=connector_access.get('ssl_verify', True),
         stream=True
     )
-    r.raise_for_status()
+    if raise_for_status:
+        r.raise_for_status()
+    return r
 
-    local_file_path = os.path.join(local_file_dir, local_file_name)
 
-    with open(local_file_path, 'wb') as f:
-        for chunk in r.iter_content(chunk_size=4096):
+def _content_range_size(content_range):
+    """Returns the complete length from a Content-Range header like 'bytes 0-0/1234' or None if it is unknown."""
+    unit, _, file_range = content_range.partition(' ')
+    file_size = file_range.rpartition('/')[2]
+    if unit != 'bytes' or not file_size.isdigit():
+        return None
+    return int(file_size)
+
+
+def _content_range_start(content_range):
+    unit, _, file_range = content_range.partition(' ')
+    first = file_range.partition('-')[0]
+    if unit != 'bytes' or not first.isdigit():
+        return None
+    return int(first)
+
+
+def _http_plan(connector_access, checkpoint, max_connections):
+    """Probes the server and splits the download into segments. Returns the response if it is the complete file."""
+    r = _http_get(
+        connector_access, headers={'Range': 'bytes=0-0', 'Accept-Encoding': 'identity'}, raise_for_status=False
+    )
+    # e.g. 404, no partial file is created, 416 is the answer for an empty file
+    if r.status_code != 416:
+        try:
+            r.raise_for_status()
+        except HTTPError:
+            r.close()
+            raise
+
+    file_size = None
+    if r.status_code == 206:
+        file_size = _content_range_size(r.headers.get('Content-Range', ''))
+    validator = r.headers.get('ETag') or r.headers.get('Last-Modified')
+    if r.status_code != 200:
+        r.close()
+        r = None
+
+    # a checksum like sha256 cannot be combined from the hashes of segments, all bytes after the first segment would
+    # be read back from the disk by verify. A single connection is slower on links with a high bandwidth-delay
+    # product, but the file is hashed while it arrives.
+    if checkpoint.stream_checksum:
+        max_connections = 1
+
+    if file_size is not None and max_connections > 1 and file_size >= 2 * MIN_SEGMENT_SIZE:
+        num_segments = min(max_connections, file_size // MIN_SEGMENT_SIZE)
+        segment_size = -(-file_size // num_segments)
+        segments = [
+            [first, min(first + segment_size, file_size) - 1, first]
+            for first in range(0, file_size, segment_size)
+        ]
+    elif file_size is not None:
+        segments = [[0, file_size - 1, 0]]
+    else:
+        # the size is unknown or the server does not support ranges
+        segments = [[0, None, 0]]
+
+    checkpoint.start(validator, file_size, segments)
+    return r
+
+
+def _http_download(connector_access, checkpoint, chunk_size, max_connections):
+    r = None
+    if connector_access.get('accept_encoding'):
+        # positions in an encoded response do not correspond to positions in the file
+        if checkpoint.state['segments']:
+            checkpoint.reset()
+        checkpoint.start(None, None, [[0, None, 0]])
+    elif not checkpoint.state['segments']:
+        r = _http_plan(connector_access, checkpoint, max_connections)
+
+    segments = [s for s in checkpoint.state['segments'] if s[1] is None or s[2] <= s[1]]
+
+    fd = os.open(checkpoint.part_path, os.O_WRONLY)
+    try:
+        if len(segments) == 1:
+            _http_get_segment(connector_access, fd, checkpoint, segments[0], chunk_size, r)
+        elif segments:
+            with TransferScheduler(max_workers=len(segments)) as scheduler:
+                for segment in segments:
+                    scheduler.submit(
+                        'bytes={}-{}'.format(segment[2], segment[1]),
+                        None,
+                        _http_get_segment,
+                        connector_access, fd, checkpoint, segment, chunk_size
+                    )
+                scheduler.wait()
+    except _SourceChanged:
+        checkpoint.reset()
+        raise
+    except TransferError as e:
+        if any(isinstance(c, _SourceChanged) for c in e.exceptions):
+            checkpoint.reset()
+        raise
+    finally:
+        os.close(fd)
+        if r is not None:
+            r.close()
+
+
+def _http_get_segment(connector_access, fd, checkpoint, segment, chunk_size, r=None):
+    first, last, offset = segment
+    validator = checkpoint.state['validator']
+
+    if r is None:
+        headers = {'Accept-Encoding': ACCEPT_ENCODING if connector_access.get('accept_encoding') else 'identity'}
+        if offset > 0 or last is not None:
+            headers['Range'] = 'bytes={}-{}'.format(offset, '' if last is None else last)
+            if validator:
+                headers['If-Range'] = validator
+        r = _http_get(connector_access, headers=headers)
+
+    with r:
+        if r.status_code == 206:
+            if _content_range_start(r.headers.get('Content-Range', '')) != offset:
+                raise _SourceChanged('Server answered with an unexpected range.')
+        elif offset > first or last is not None:
+            # the complete file was sent instead of the requested range
+            if first != 0 or last is not None:
+                raise _SourceChanged('Server did not answer range request, the file may have changed.')
+            checkpoint.restart(segment)
+
+        checkpoint.prepare_checksum(segment)
+        for chunk in _iter_body(connector_access, r, chunk_size):
             if chunk:
-                f.write(chunk)
-    r.raise_for_status()
+                os.pwrite(fd, chunk, segment[2])
+                checkpoint.advance(segment, chunk)
+
+        content_encoding = r.headers.get('Content-Encoding', 'identity')
+        if connector_access.get('accept_encoding') and content_encoding != 'identity':
+            # the number of bytes received before decoding
+            checkpoint.content_encoding = content_encoding
+            checkpoint.encoded_bytes = r.raw.tell()
+
+    if last is None:
+        os.ftruncate(fd, segment[2])
+    elif segment[2] != last + 1:
+        raise Exception('Received {} of {} bytes for range {}-{}.'.format(
+            segment[2] - first, last + 1 - first, first, last
+        ))
+
+
+def _iter_body(connector_access, r, chunk_size):
+    if connector_access.get('accept_encoding'):
+        return r.iter_content(chunk_size=chunk_size)
+    # servers send e.g. .gz files with Content-Encoding gzip, which must not be decoded to keep the byte positions
+    return r.raw.stream(chunk_size, decode_content=False)
 
 
 def ssh(connector_access, local_input_file):
+    """Downloads a file via SFTP, continuing at the offset where a failed attempt stopped."""
     local_file_dir = local_input_file['dir']
     local_file_name = local_input_file['name']
 
@@ -39,14 +227,228 @@ def ssh(connector_access, local_input_file):
 
     remote_file_path = os.path.join(connector_access['file_dir'], connector_access['file_name'])
     local_file_path = os.path.join(local_file_dir, local_file_name)
+    checkpoint = _Checkpoint(local_file_path, 'sftp://{}:{}{}'.format(
+        connector_access['host'], connector_access.get('port', 22), remote_file_path
+    ), checksums.for_connector(connector_access))
+
+    def download():
+        with ssh_connections.open_sftp(connector_access) as sftp:
+            attributes = sftp.stat(remote_file_path)
+            validator = '{}:{}'.format(attributes.st_size, attributes.st_mtime)
+            if checkpoint.state['segments'] and checkpoint.state['validator'] != validator:
+                checkpoint.reset()
+            if not checkpoint.state['segments']:
+                checkpoint.start(validator, attributes.st_size, [[0, attributes.st_size - 1, 0]])
+
+            segment = checkpoint.state['segments'][0]
+            checkpoint.prepare_checksum(segment)
+            ssh_connections.get(
+                sftp,
+                remote_file_path,
+                checkpoint.part_path,
+                block_size=connector_access.get('block_size', ssh_connections.DEFAULT_BLOCK_SIZE),
+                max_requests=connector_access.get('max_requests'),
+                offset=segment[2],
+                progress=lambda data: checkpoint.advance(segment, data)
+            )
+            if segment[2] != segment[1] + 1:
+                raise Exception('Received {} of {} bytes.'.format(segment[2], segment[1] + 1))
+
+    start = monotonic()
+    retries = _with_retries(connector_access, checkpoint, download)
+    checkpoint.verify()
+    checkpoint.finish(compression.for_download(connector_access, connector_access['file_name']))
+
+    _record_download(local_file_path, 'ssh', checkpoint, retries, monotonic() - start)
+
+
+class _SourceChanged(Exception):
+    pass
+
+
+class _Checkpoint:
+    """Progress of a partial download, stored next to the partial file to continue it after a failure."""
+    def __init__(self, local_file_path, source, checksum=None):
+        self.local_file_path = local_file_path
+        self.stream_checksum = checksums.StreamChecksum(checksum) if checksum else None
+        self.part_path = local_file_path + PART_SUFFIX
+        self.path = local_file_path + CHECKPOINT_SUFFIX
+        self.source = source
+        self.lock = Lock()
+        self.unsaved_bytes = 0
+        self.resumed_bytes = 0
+        self.refetched_bytes = 0
+        self._resumed_position = 0
+        self.content_encoding = None
+        self.encoded_bytes = None
+        self.decompressor = None
+        self.state = self._load()
+        self.resume()
+
+    def _empty_state(self):
+        return {'source': self.source, 'validator': None, 'size': None, 'segments': []}
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+            if state['source'] == self.source and os.path.isfile(self.part_path):
+                return state
+        except (OSError, ValueError, KeyError):
+            pass
+        return self._empty_state()
+
+    def completed_bytes(self):
+        return sum(s[2] - s[0] for s in self.state['segments'])
+
+    def start(self, validator, size, segments):
+        self.state = {'source': self.source, 'validator': validator, 'size': size, 'segments': segments}
+        with open(self.part_path, 'wb') as f:
+            if size:
+                try:
+                    os.posix_fallocate(f.fileno(), 0, size)
+                except OSError:
+                    f.truncate(size)
+        self.save()
+
+    def resume(self):
+        # only the bytes completed since the previous attempt, the earlier ones have been counted already
+        completed_bytes = self.completed_bytes()
+        self.resumed_bytes += max(0, completed_bytes - self._resumed_position)
+        self._resumed_position = completed_bytes
+
+    def restart(self, segment):
+        with self.lock:
+            self.refetched_bytes += segment[2] - segment[0]
+            segment[2] = segment[0]
+            self._resumed_position = min(self._resumed_position, self.completed_bytes())
+        if self.stream_checksum and self.stream_checksum.position > segment[0]:
+            self.stream_checksum.reset()
 
-    with SSHClient() as client:
-        client.set_missing_host_key_policy(AutoAddPolicy())
-        client.connect(
-            connector_access['host'],
-            port=connector_access.get('port', 22),
-            username=connector_access['username'],
-            password=connector_access['password']
-        )
-        with client.open_sftp() as sftp:
-            sftp.get(remote_file_path, local_file_path)
+    def reset(self):
+        with self.lock:
+            self.refetched_bytes += self.completed_bytes()
+            self.state = self._empty_state()
+            self._resumed_position = 0
+        if self.stream_checksum:
+            self.stream_checksum.reset()
+
+    def prepare_checksum(self, segment):
+        """Hashes the completed part of a resumed segment, so that its remaining bytes can be hashed as they arrive."""
+        if self.stream_checksum and segment[0] <= self.stream_checksum.position < segment[2]:
+            self.stream_checksum.catch_up(self.part_path, segment[2])
+
+    def advance(self, segment, data):
+        # only the thread downloading a segment changes its position
+        _check_cancelled()
+        if self.stream_checksum:
+            self.stream_checksum.feed(segment[2], data)
+        with self.lock:
+            segment[2] += len(data)
+            self.unsaved_bytes += len(data)
+            if self.unsaved_bytes >= CHECKPOINT_INTERVAL:
+                self._save()
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def _save(self):
+        if not self.state['segments']:
+            return
+        with open(self.path, 'w') as f:
+            json.dump(self.state, f)
+        self.unsaved_bytes = 0
+
+    def verify(self):
+        if not self.stream_checksum:
+            return
+        self.stream_checksum.catch_up(self.part_path, os.path.getsize(self.part_path))
+        try:
+            self.stream_checksum.checksum.verify(self.local_file_path)
+        except checksums.ChecksumMismatch:
+            os.remove(self.part_path)
+            self.remove()
+            raise
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def finish(self, algorithm=None):
+        """Moves the complete file to the local file path. A compressed file is decompressed instead."""
+        if algorithm:
+            unpack_path = self.local_file_path + UNPACK_SUFFIX
+            try:
+                self.decompressor = compression.decompress_file(self.part_path, unpack_path, algorithm)
+                os.replace(unpack_path, self.local_file_path)
+            except:
+                # a corrupt file is downloaded again by the next attempt
+                os.remove(self.part_path)
+                self.remove()
+                raise
+            finally:
+                if os.path.exists(unpack_path):
+                    os.remove(unpack_path)
+            os.remove(self.part_path)
+        else:
+            os.replace(self.part_path, self.local_file_path)
+        self.remove()
+
+
+def _is_retryable(e):
+    if isinstance(e, TransferCancelled):
+        return False
+    if isinstance(e, TransferError):
+        # segments without exceptions have been cancelled
+        return bool(e.exceptions) and all(_is_retryable(c) for c in e.exceptions)
+    if isinstance(e, HTTPError):
+        return e.response is None or e.response.status_code >= 500
+    if isinstance(e, (FileNotFoundError, PermissionError)):
+        return False
+    return True
+
+
+def _with_retries(connector_access, checkpoint, download, fatal=()):
+    """Calls download until it succeeds or fails with a fatal exception. Returns the number of retries."""
+    max_retries = connector_access.get('max_retries', DEFAULT_MAX_RETRIES)
+    retry_backoff = connector_access.get('retry_backoff', DEFAULT_RETRY_BACKOFF)
+
+    retries = 0
+    while True:
+        try:
+            download()
+            return retries
+        except Exception as e:
+            if checkpoint:
+                checkpoint.save()
+            if retries >= max_retries or isinstance(e, fatal) or not _is_retryable(e):
+                raise
+        sleep(retry_backoff * 2 ** retries)
+        retries += 1
+        if checkpoint:
+            checkpoint.resume()
+
+
+def _record_download(local_file_path, connector_type, checkpoint, retries, seconds, **values):
+    if checkpoint.stream_checksum:
+        values['checksum'] = checkpoint.stream_checksum.checksum.result()
+        values['checksum_inline_bytes'] = checkpoint.stream_checksum.inline_bytes
+    if checkpoint.content_encoding:
+        values['content_encoding'] = checkpoint.content_encoding
+        values['encoded_bytes'] = checkpoint.encoded_bytes
+    if checkpoint.decompressor:
+        values['compression'] = checkpoint.decompressor.algorithm
+        values['compressed_bytes'] = checkpoint.decompressor.compressed_bytes
+    stats.update(
+        'download',
+        local_file_path,
+        connector_type=connector_type,
+        retries=retries,
+        resumed_bytes=checkpoint.resumed_bytes,
+        refetched_bytes=checkpoint.refetched_bytes,
+        **values
+    )
+    stats.record_throughput('download', local_file_path, os.path.getsize(local_file_path), seconds)
@@ -1,4 +1,6 @@
 import os
+from functools import wraps
+
 from requests.auth import HTTPBasicAuth, HTTPDigestAuth
 
 
@@ -21,8 +23,18 @@ def auth(http_auth):
     raise Exception('Authorization information is not valid.')
 
 
+def clear_after_fork(lock, cache):
+    """Clears a process-wide connection cache in forked processes, e.g. the gunicorn workers, which must not share the
+    connections of their parent. The lock of the cache is held while forking."""
+    def after_in_child():
+        lock.release()
+        cache.clear()
+    os.register_at_fork(before=lock.acquire, after_in_parent=lock.release, after_in_child=after_in_child)
+
+
 def skip_optional(func):
     """function decorator"""
+    @wraps(func)
     def wrapper(connector_access, local_result_file, metadata):
         local_file_path = os.path.join(local_result_file['dir'], local_result_file['name'])
         if not os.path.isfile(local_file_path):
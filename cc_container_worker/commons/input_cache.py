@@ -0,0 +1,176 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+from contextlib import contextmanager
+
+from cc_container_worker.commons import helper
+from cc_container_worker.commons import sessions
+from cc_container_worker.commons import ssh_connections
+from cc_container_worker.commons import stats
+
+FICLONE = 0x40049409
+
+
+class InputCache:
+    """Content-addressed cache for input files in a directory shared by all containers on a node, e.g. a mounted host
+    volume.
+
+    Files are keyed by their declared checksum digest (the checksum field of connector_access) or by their source and a
+    validator which changes with the content (HTTP ETag or Last-Modified, SFTP size and mtime). Files without a stable
+    key are downloaded without caching. Concurrent containers fetching the same file are serialized with file locks,
+    so every file is downloaded once. The least recently used files are evicted if the cache grows beyond max_size
+    bytes. Cached files are placed into the local input path as reflink, hardlink or copy, in that order of preference.
+    """
+    def __init__(self, cache_dir, max_size=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        self.tmp_dir = os.path.join(cache_dir, 'tmp')
+        self.locks_dir = os.path.join(cache_dir, 'locks')
+        for d in [self.objects_dir, self.tmp_dir, self.locks_dir]:
+            if not os.path.exists(d):
+                os.makedirs(d, exist_ok=True)
+
+    def fetch(self, connector, input_file, local_input_file):
+        local_file_path = os.path.join(local_input_file['dir'], local_input_file['name'])
+        key = _cache_key(input_file)
+        if key is None:
+            connector(input_file['connector_access'], local_input_file)
+            stats.update('download', local_file_path, cache='bypass')
+            return
+
+        object_path = os.path.join(self.objects_dir, key)
+        with _locked(os.path.join(self.locks_dir, key)):
+            if os.path.isfile(object_path):
+                # the modification time of cached files is used as last access time for the LRU eviction
+                os.utime(object_path)
+                _place(object_path, local_file_path)
+                stats.update(
+                    'download', local_file_path, cache='hit', cache_bytes_saved=os.path.getsize(object_path)
+                )
+                return
+
+            connector(input_file['connector_access'], {'dir': self.tmp_dir, 'name': key})
+            tmp_path = os.path.join(self.tmp_dir, key)
+            os.chmod(tmp_path, 0o444)
+            os.replace(tmp_path, object_path)
+            _place(object_path, local_file_path)
+
+            stats.move('download', tmp_path, local_file_path)
+            stats.update('download', local_file_path, cache='miss')
+
+        self.evict(keep=object_path)
+
+    def evict(self, keep=None):
+        if not self.max_size:
+            return
+        with _locked(os.path.join(self.cache_dir, 'evict')):
+            entries = []
+            for name in os.listdir(self.objects_dir):
+                path = os.path.join(self.objects_dir, name)
+                try:
+                    s = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((s.st_mtime, s.st_size, name, path))
+
+            total_size = sum(e[1] for e in entries)
+            for _, size, name, path in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+                if path == keep:
+                    continue
+                # files which are currently fetched or placed are skipped
+                with _locked(os.path.join(self.locks_dir, name), blocking=False) as acquired:
+                    if not acquired:
+                        continue
+                    os.remove(path)
+                    total_size -= size
+
+
+@contextmanager
+def _locked(lock_path, blocking=True):
+    with open(lock_path, 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _place(object_path, local_file_path):
+    local_file_dir = os.path.dirname(local_file_path)
+    if not os.path.exists(local_file_dir):
+        os.makedirs(local_file_dir)
+    if os.path.lexists(local_file_path):
+        os.remove(local_file_path)
+
+    try:
+        with open(object_path, 'rb') as src, open(local_file_path, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return
+    except OSError:
+        os.remove(local_file_path)
+
+    try:
+        os.link(object_path, local_file_path)
+        return
+    except OSError:
+        pass
+
+    shutil.copyfile(object_path, local_file_path)
+
+
+def _cache_key(input_file):
+    connector_type = input_file['connector_type']
+    connector_access = input_file['connector_access']
+
+    # a checksum without a digest, e.g. 'sha256', is only computed and does not identify the file
+    _, _, digest = (connector_access.get('checksum') or '').partition(':')
+    if digest:
+        source = {'checksum': connector_access['checksum']}
+    elif connector_type == 'http':
+        validator = _http_validator(connector_access)
+        if not validator:
+            return None
+        source = {'url': connector_access['url'], 'validator': validator}
+    elif connector_type == 'ssh':
+        source = {
+            'host': connector_access['host'],
+            'port': connector_access.get('port', 22),
+            'file_dir': connector_access['file_dir'],
+            'file_name': connector_access['file_name'],
+            'validator': _ssh_validator(connector_access)
+        }
+    else:
+        return None
+
+    if connector_access.get('decompress'):
+        # the cached file is the decompressed source
+        source['decompress'] = connector_access['decompress']
+
+    return hashlib.sha256(json.dumps(source, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _http_validator(connector_access):
+    r = sessions.session(connector_access['url']).head(
+        connector_access['url'],
+        auth=helper.auth(connector_access.get('auth')),
+        verify=connector_access.get('ssl_verify', True),
+        allow_redirects=True
+    )
+    if r.status_code != 200:
+        return None
+    return r.headers.get('ETag') or r.headers.get('Last-Modified')
+
+
+def _ssh_validator(connector_access):
+    with ssh_connections.open_sftp(connector_access) as sftp:
+        attributes = sftp.stat(os.path.join(connector_access['file_dir'], connector_access['file_name']))
+    return '{}:{}'.format(attributes.st_size, attributes.st_mtime)
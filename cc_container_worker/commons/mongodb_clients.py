@@ -0,0 +1,51 @@
+import atexit
+from threading import Lock
+
+_lock = Lock()
+_clients = {}
+
+
+def _uri(connector_access):
+    url_parameters = ''
+    enable_ssl = connector_access.get('enable_ssl', True)
+    ssl_verify = connector_access.get('ssl_verify', True)
+    ssl_ca_cert_path = connector_access.get('ssl_ca_cert_path')
+    if enable_ssl:
+        url_parameters = '?ssl=true'
+        if ssl_ca_cert_path:
+            url_parameters = '{}&ssl_ca_certs={}'.format(url_parameters, ssl_ca_cert_path)
+        elif not ssl_verify:
+            url_parameters = '{}&ssl_cert_reqs=CERT_NONE'.format(url_parameters)
+
+    return 'mongodb://{}:{}@{}:{}/{}{}'.format(
+        connector_access['username'],
+        connector_access['password'],
+        connector_access['host'],
+        connector_access.get('port', 27017),
+        connector_access['db'],
+        url_parameters
+    )
+
+
+def client(connector_access):
+    """Returns the process-wide MongoClient for the server, credentials and database of connector_access. Clients are
+    thread-safe and keep their own connection pool, so all uploads of a task share them."""
+    import pymongo
+    uri = _uri(connector_access)
+    with _lock:
+        c = _clients.get(uri)
+        if c is None:
+            c = pymongo.MongoClient(uri)
+            _clients[uri] = c
+        return c
+
+
+def close():
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for c in clients:
+        c.close()
+
+
+atexit.register(close)
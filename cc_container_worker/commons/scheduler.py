@@ -0,0 +1,179 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from threading import Event, Lock, local
+from traceback import format_exception
+
+DEFAULT_MAX_WORKERS = 8
+# running transfers notice their cancellation with their next block, transfers blocked longer are abandoned
+CANCEL_GRACE_SECONDS = 5
+
+# the cancellation events of the transfer running in the current thread and of the transfers which submitted it
+_current = local()
+
+
+class TransferCancelled(Exception):
+    pass
+
+
+class TransferError(Exception):
+    def __init__(self, errors, cancelled=None, exceptions=None):
+        self.errors = errors
+        self.cancelled = cancelled or []
+        self.exceptions = exceptions or []
+
+        lines = ['{} transfer(s) failed.'.format(len(errors))]
+        for error in errors:
+            lines.append('[{}]\n{}'.format(error['name'], error['exception']))
+        if self.cancelled:
+            lines.append('Cancelled: {}'.format(', '.join(self.cancelled)))
+        super(TransferError, self).__init__('\n'.join(lines))
+
+
+def _events():
+    return getattr(_current, 'events', [])
+
+
+def check_cancelled():
+    """Raises TransferCancelled if the transfer running in the current thread has been cancelled. Connectors call it
+    for every block, so that a failed transfer does not wait for the other transfers of its group."""
+    if any(e.is_set() for e in _events()):
+        raise TransferCancelled()
+
+
+class TransferScheduler:
+    """Runs independent transfers on a bounded thread pool.
+
+    max_workers_per_key limits how many transfers sharing the same key (e.g. a host or a connector type) run at the
+    same time. It is either an int applied to every key or a dict mapping keys to individual limits. Transfers of a key
+    at its limit wait in a queue of the key and do not occupy a thread, so that transfers of other keys can start.
+
+    Transfers can be awaited in independent groups: a failure only cancels the other transfers of the awaited group.
+    """
+    def __init__(self, max_workers=None, max_workers_per_key=None):
+        self.max_workers = max_workers or DEFAULT_MAX_WORKERS
+        self.max_workers_per_key = max_workers_per_key
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._pending = {}
+        self._running = {}
+        self._lock = Lock()
+        self._jobs = []
+        self._abandoned = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def submit(self, name, key, func, *args):
+        cancelled = Event()
+        # transfers submitted by a transfer, e.g. the segments of a download, are cancelled with it
+        events = _events() + [cancelled]
+        future = Future()
+        with self._lock:
+            self._jobs.append((name, future, cancelled))
+            self._pending.setdefault(key, deque()).append((future, events, func, args))
+        self._dispatch(key)
+        return future
+
+    def cancel(self, futures=None):
+        with self._lock:
+            for _, future, cancelled in self._jobs:
+                if futures is None or future in futures:
+                    cancelled.set()
+                    future.cancel()
+
+    def wait(self, futures=None):
+        """Waits for the given futures (all submitted futures by default) and cancels the remaining transfers of this
+        group as soon as one of them fails. Raises a TransferError listing every failed transfer. Cancelled transfers
+        which do not stop within CANCEL_GRACE_SECONDS are abandoned and listed as cancelled."""
+        with self._lock:
+            jobs = [(name, f, c) for name, f, c in self._jobs if futures is None or f in futures]
+
+        done, not_done = wait([f for _, f, _ in jobs], return_when=FIRST_EXCEPTION)
+        if not_done:
+            self.cancel(not_done)
+            done, not_done = wait(not_done, timeout=CANCEL_GRACE_SECONDS)
+            if not_done:
+                self._abandoned = True
+
+        errors = []
+        cancelled = []
+        exceptions = []
+        for name, future, cancel_event in jobs:
+            if future.cancelled() or not future.done():
+                cancelled.append(name)
+                continue
+            e = future.exception()
+            if e is not None and cancel_event.is_set():
+                # e.g. the TransferError of a download whose segments have been cancelled
+                cancelled.append(name)
+            elif isinstance(e, TransferCancelled):
+                cancelled.append(name)
+            elif e is not None:
+                exceptions.append(e)
+                errors.append({
+                    'name': name,
+                    'exception': ''.join(format_exception(type(e), e, e.__traceback__))
+                })
+
+        if errors or cancelled:
+            raise TransferError(errors, cancelled, exceptions)
+
+    def shutdown(self):
+        # abandoned transfers keep their threads until they return, but do not block the caller
+        if not self._abandoned:
+            with self._lock:
+                futures = [future for _, future, _ in self._jobs]
+            wait(futures)
+        self._executor.shutdown(wait=not self._abandoned)
+
+    def _limit(self, key):
+        limit = self.max_workers_per_key
+        if isinstance(limit, dict):
+            limit = limit.get(key)
+        return limit or None
+
+    def _dispatch(self, key):
+        """Hands the queued transfers of key to the thread pool while the key is below its limit."""
+        while True:
+            with self._lock:
+                pending = self._pending.get(key)
+                limit = self._limit(key)
+                if not pending or (limit and self._running.get(key, 0) >= limit):
+                    return
+                future, events, func, args = pending.popleft()
+                # cancelled while queued
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self._running[key] = self._running.get(key, 0) + 1
+            try:
+                self._executor.submit(self._run, future, events, key, func, *args)
+            except RuntimeError as e:
+                # the thread pool has been shut down after transfers were abandoned
+                self._finish(key)
+                future.set_exception(TransferCancelled(str(e)))
+
+    def _finish(self, key):
+        with self._lock:
+            self._running[key] -= 1
+
+    def _run(self, future, events, key, func, *args):
+        _current.events = events
+        result = None
+        exception = None
+        try:
+            check_cancelled()
+            result = func(*args)
+        except BaseException as e:
+            exception = e
+        finally:
+            _current.events = []
+        # the next transfer of the key starts before the result is delivered
+        self._finish(key)
+        self._dispatch(key)
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
@@ -1,3 +1,5 @@
+import re
+
 application_config_schema = {
     'type': 'object',
     'properties': {
@@ -17,3 +19,65 @@ application_config_schema = {
     'required': ['application_command', 'local_input_files', 'local_result_files'],
     'additionalProperties': False
 }
+
+# keywords and types understood by _compile, schemas using others are always validated with jsonschema
+_KEYWORDS = {'type', 'properties', 'required', 'additionalProperties', 'patternProperties', 'items'}
+_TYPES = {'object': dict, 'array': list, 'string': str, 'boolean': bool, 'null': type(None)}
+
+
+def _compile(schema):
+    """Compiles a schema into a function, which returns whether a value is valid, without jsonschema. Returns None if
+    the schema uses keywords or types, which are not supported."""
+    if not isinstance(schema, dict) or not set(schema) <= _KEYWORDS:
+        return None
+    value_type = None
+    if 'type' in schema:
+        value_type = _TYPES.get(schema['type'])
+        if value_type is None:
+            return None
+
+    properties = {key: _compile(sub_schema) for key, sub_schema in schema.get('properties', {}).items()}
+    patterns = [(re.compile(p), _compile(sub_schema)) for p, sub_schema in schema.get('patternProperties', {}).items()]
+    additional = schema.get('additionalProperties', True)
+    if isinstance(additional, dict):
+        additional = _compile(additional)
+    items = _compile(schema['items']) if 'items' in schema else True
+    checks = list(properties.values()) + [c for _, c in patterns] + [additional, items]
+    if any(c is None for c in checks):
+        return None
+    required = schema.get('required', [])
+
+    def is_valid(value):
+        if value_type is not None and not isinstance(value, value_type):
+            return False
+        if isinstance(value, dict):
+            if any(key not in value for key in required):
+                return False
+            for key, v in value.items():
+                matched = key in properties
+                if matched and not properties[key](v):
+                    return False
+                for pattern, check in patterns:
+                    if pattern.search(key):
+                        matched = True
+                        if not check(v):
+                            return False
+                if not matched and additional is not True and (additional is False or not additional(v)):
+                    return False
+        if isinstance(value, list) and items is not True:
+            return all(items(v) for v in value)
+        return True
+
+    return is_valid
+
+
+_is_valid_application_config = _compile(application_config_schema)
+
+
+def validate_application_config(config):
+    """Validates config against application_config_schema. Importing jsonschema takes longer than the rest of the
+    startup, therefore it is only used to describe why a config is invalid."""
+    if _is_valid_application_config and _is_valid_application_config(config):
+        return
+    import jsonschema
+    jsonschema.validate(config, application_config_schema)
@@ -0,0 +1,106 @@
+import atexit
+from threading import Lock
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from cc_container_worker.commons import helper
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+RETRY_STATUS_CODES = (502, 503, 504)
+# seconds (connect, read), the read timeout applies to every socket operation, not to the whole request
+DEFAULT_TIMEOUT = (10, 300)
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+_lock = Lock()
+_sessions = {}
+_config = {
+    'pool_size': DEFAULT_POOL_SIZE,
+    'max_retries': DEFAULT_MAX_RETRIES,
+    'backoff_factor': DEFAULT_BACKOFF_FACTOR,
+    'timeout': DEFAULT_TIMEOUT
+}
+
+
+class _TimeoutAdapter(HTTPAdapter):
+    """Applies a default timeout to requests without an explicit timeout."""
+    def __init__(self, timeout, **kwargs):
+        self.timeout = timeout
+        super(_TimeoutAdapter, self).__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        return super(_TimeoutAdapter, self).send(request, timeout=timeout, **kwargs)
+
+
+def configure(pool_size=None, max_retries=None, backoff_factor=None, timeout=None):
+    """Changes the settings for sessions created afterwards. Existing sessions are closed. The timeout is a number
+    of seconds or a (connect, read) pair, e.g. a list from the JSON settings."""
+    with _lock:
+        if pool_size is not None:
+            _config['pool_size'] = pool_size
+        if max_retries is not None:
+            _config['max_retries'] = max_retries
+        if backoff_factor is not None:
+            _config['backoff_factor'] = backoff_factor
+        if timeout is not None:
+            _config['timeout'] = tuple(timeout) if isinstance(timeout, list) else timeout
+        _close_sessions()
+
+
+def session(url, retry_status=True, max_retries=None):
+    """Returns the process-wide requests.Session for the origin (scheme, host and port) of url.
+
+    Requests with a body which cannot be rewound, e.g. a generator sent with chunked transfer encoding, must use a
+    session with retry_status=False. Otherwise a gateway error would be retried with the exhausted body. Callers
+    retrying on their own pass max_retries=0, which overrides the configured number of retries.
+    """
+    parsed = urlparse(url)
+    key = (parsed.scheme, parsed.hostname, parsed.port or DEFAULT_PORTS.get(parsed.scheme), retry_status, max_retries)
+    with _lock:
+        s = _sessions.get(key)
+        if s is None:
+            s = _create_session(retry_status, max_retries)
+            _sessions[key] = s
+        return s
+
+
+def close():
+    with _lock:
+        _close_sessions()
+
+
+def _create_session(retry_status, max_retries):
+    # only connection errors and gateway errors are retried, other failures are left to the caller
+    retry = Retry(
+        total=_config['max_retries'] if max_retries is None else max_retries,
+        read=0,
+        backoff_factor=_config['backoff_factor'],
+        status_forcelist=RETRY_STATUS_CODES if retry_status else (),
+        raise_on_status=False
+    )
+    adapter = _TimeoutAdapter(
+        _config['timeout'],
+        pool_connections=1,
+        pool_maxsize=_config['pool_size'],
+        max_retries=retry
+    )
+    s = requests.Session()
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
+    return s
+
+
+def _close_sessions():
+    for s in _sessions.values():
+        s.close()
+    _sessions.clear()
+
+
+atexit.register(close)
+helper.clear_after_fork(_lock, _sessions)
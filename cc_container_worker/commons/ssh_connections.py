@@ -0,0 +1,188 @@
+import atexit
+from contextlib import contextmanager
+from threading import Lock
+
+from cc_container_worker.commons import helper
+from cc_container_worker.commons import stats
+from cc_container_worker.commons.scheduler import check_cancelled
+
+DEFAULT_WINDOW_SIZE = 16 * 1024 * 1024
+DEFAULT_BLOCK_SIZE = 32768
+# outstanding read requests, at most max_requests * block_size bytes (2 MiB by default) are held in memory per file
+DEFAULT_MAX_REQUESTS = 64
+
+_lock = Lock()
+_connections = {}
+
+
+class _Connection:
+    """One authenticated SSH transport shared by all transfers to the same (host, port, username).
+
+    Every concurrent transfer gets its own SFTP channel on the shared transport. Channels are kept open after use and
+    handed out again to later transfers requesting the same window settings.
+    """
+    def __init__(self, connector_access):
+        self.connector_access = connector_access
+        self.client = None
+        self.lock = Lock()
+        self.idle_channels = {}
+
+    def _connect(self):
+        # paramiko is only imported by tasks using SFTP
+        import paramiko
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        with stats.span('ssh_connect', host=self.connector_access['host']):
+            client.connect(
+                self.connector_access['host'],
+                port=self.connector_access.get('port', 22),
+                username=self.connector_access['username'],
+                password=self.connector_access['password']
+            )
+        self.client = client
+
+    def _is_active(self):
+        if self.client is None:
+            return False
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def acquire(self, window_size, max_packet_size):
+        with self.lock:
+            if not self._is_active():
+                self._close()
+                self._connect()
+            idle = self.idle_channels.get((window_size, max_packet_size))
+            if idle:
+                return idle.pop()
+            import paramiko
+            return paramiko.SFTPClient.from_transport(
+                self.client.get_transport(),
+                window_size=window_size,
+                max_packet_size=max_packet_size
+            )
+
+    def release(self, sftp, window_size, max_packet_size):
+        with self.lock:
+            if self._is_active() and not sftp.sock.closed:
+                try:
+                    # reset the working directory changed by transfers
+                    sftp.chdir(None)
+                except Exception:
+                    sftp.close()
+                    return
+                self.idle_channels.setdefault((window_size, max_packet_size), []).append(sftp)
+            else:
+                sftp.close()
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+    def _close(self):
+        for channels in self.idle_channels.values():
+            for sftp in channels:
+                sftp.close()
+        self.idle_channels = {}
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+
+def _connection(connector_access):
+    key = (connector_access['host'], connector_access.get('port', 22), connector_access['username'])
+    with _lock:
+        connection = _connections.get(key)
+        if connection is None:
+            connection = _Connection(connector_access)
+            _connections[key] = connection
+        return connection
+
+
+@contextmanager
+def open_sftp(connector_access):
+    """Yields an SFTP channel on the cached SSH connection for connector_access.
+
+    The SSH flow control window and the maximum packet size of the channel can be set with the optional window_size
+    and max_packet_size fields of connector_access. Large windows are required to reach link speed on high-latency
+    links.
+    """
+    window_size = connector_access.get('window_size', DEFAULT_WINDOW_SIZE)
+    max_packet_size = connector_access.get('max_packet_size')
+
+    connection = _connection(connector_access)
+    sftp = connection.acquire(window_size, max_packet_size)
+    try:
+        yield sftp
+    except:
+        sftp.close()
+        raise
+    connection.release(sftp, window_size, max_packet_size)
+
+
+def read(sftp, remote_file_path, block_size, max_requests=None, offset=0):
+    """Yields the blocks of a file starting at offset, fetched with up to max_requests (DEFAULT_MAX_REQUESTS if None)
+    outstanding read requests of block_size bytes. The requests are sent in windows of max_requests blocks, since
+    paramiko buffers the prefetched blocks of a file until they are read, e.g. by a slow reader of a named pipe."""
+    max_requests = max_requests or DEFAULT_MAX_REQUESTS
+    window_size = max_requests * block_size
+    with sftp.open(remote_file_path, 'rb', bufsize=block_size) as remote_file:
+        remote_file.MAX_REQUEST_SIZE = block_size
+        size = remote_file.stat().st_size
+        for start in range(offset, size, window_size):
+            end = min(start + window_size, size)
+            chunks = [(o, min(block_size, end - o)) for o in range(start, end, block_size)]
+            for data in remote_file.readv(chunks, max_requests):
+                check_cancelled()
+                if not data:
+                    return
+                yield data
+
+
+def get(sftp, remote_file_path, local_file_path, block_size, max_requests=None, offset=0, progress=None):
+    """Downloads a file starting at offset with up to max_requests outstanding read requests of block_size bytes. The
+    optional progress function is called with every block written. Returns the number of bytes transferred."""
+    num_bytes = 0
+    with open(local_file_path, 'r+b' if offset else 'wb', buffering=0) as f:
+        f.seek(offset)
+        for data in read(sftp, remote_file_path, block_size, max_requests=max_requests, offset=offset):
+            f.write(data)
+            num_bytes += len(data)
+            if progress:
+                progress(data)
+    return num_bytes
+
+
+def write(sftp, blocks, remote_file_path, block_size, progress=None):
+    """Writes an iterable of blocks to a remote file with pipelined write requests of up to block_size bytes. The
+    optional progress function is called with every block. Returns the number of bytes transferred."""
+    num_bytes = 0
+    with sftp.open(remote_file_path, 'wb', bufsize=block_size) as remote_file:
+        remote_file.MAX_REQUEST_SIZE = block_size
+        remote_file.set_pipelined(True)
+        for data in blocks:
+            check_cancelled()
+            remote_file.write(data)
+            num_bytes += len(data)
+            if progress:
+                progress(data)
+    return num_bytes
+
+
+def put(sftp, local_file_path, remote_file_path, block_size, progress=None):
+    """Uploads a file with pipelined write requests of block_size bytes. The optional progress function is called
+    with every block read. Returns the number of bytes transferred."""
+    with open(local_file_path, 'rb') as f:
+        return write(sftp, iter(lambda: f.read(block_size), b''), remote_file_path, block_size, progress=progress)
+
+
+def close():
+    with _lock:
+        connections = list(_connections.values())
+        _connections.clear()
+    for connection in connections:
+        connection.close()
+
+
+atexit.register(close)
+helper.clear_after_fork(_lock, _connections)
@@ -0,0 +1,71 @@
+from contextlib import contextmanager
+from threading import Lock
+from time import monotonic
+
+_lock = Lock()
+_transfers = {}
+_spans = []
+_origin = monotonic()
+
+
+def update(direction, local_file_path, **values):
+    """Stores values in the record of the download or upload of local_file_path."""
+    with _lock:
+        record = _transfers.setdefault(
+            (direction, local_file_path),
+            {'direction': direction, 'local_file_path': local_file_path}
+        )
+        record.update(values)
+
+
+def record_throughput(direction, local_file_path, num_bytes, seconds):
+    update(
+        direction,
+        local_file_path,
+        bytes=num_bytes,
+        seconds=seconds,
+        throughput=num_bytes / seconds if seconds > 0 else None
+    )
+
+
+def move(direction, local_file_path, new_local_file_path):
+    """Moves a transfer record to another local path, e.g. after a downloaded file has been moved."""
+    with _lock:
+        record = _transfers.pop((direction, local_file_path), None)
+        if record is not None:
+            record['local_file_path'] = new_local_file_path
+            _transfers[(direction, new_local_file_path)] = record
+
+
+def transfers():
+    with _lock:
+        return [dict(record) for record in _transfers.values()]
+
+
+@contextmanager
+def span(name, **values):
+    """Records the duration of a phase, e.g. a download or a callback. The start is given in seconds since the worker
+    started. The yielded record can be extended with values known at the end, like the number of bytes."""
+    record = {'name': name, 'start': round(monotonic() - _origin, 3)}
+    record.update(values)
+    start = monotonic()
+    try:
+        yield record
+    except:
+        record['failed'] = True
+        raise
+    finally:
+        record['seconds'] = round(monotonic() - start, 3)
+        with _lock:
+            _spans.append(record)
+
+
+def spans():
+    with _lock:
+        return [dict(record) for record in _spans]
+
+
+def reset():
+    with _lock:
+        _transfers.clear()
+        del _spans[:]
@@ -0,0 +1,357 @@
+import errno
+import os
+from threading import Lock
+from time import monotonic, sleep
+
+from cc_container_worker.commons import checksums
+from cc_container_worker.commons import compression
+from cc_container_worker.commons import helper
+from cc_container_worker.commons import sessions
+from cc_container_worker.commons import ssh_connections
+from cc_container_worker.commons import stats
+from cc_container_worker.commons.downloaders import DEFAULT_CHUNK_SIZE, _SourceChanged, _with_retries
+from cc_container_worker.commons.scheduler import check_cancelled
+
+FIFO = 'fifo'
+GROWING_FILE = 'file'
+COMPLETE_SUFFIX = '.complete'
+DOWNLOAD_SUFFIX = '.download'
+UPLOAD_SUFFIX = '.upload'
+OPEN_POLL_SECONDS = 0.1
+FOLLOW_POLL_SECONDS = 0.1
+READ_SIZE = 1024 * 1024
+
+_lock = Lock()
+_released = set()
+_finished = {}
+
+
+class _Released(Exception):
+    pass
+
+
+class StreamAborted(Exception):
+    pass
+
+
+def stream_type(local_input_file):
+    """Returns FIFO or GROWING_FILE for streamable local input files and None otherwise. The streamable field of a
+    local input file is either true, which selects a named pipe, or one of 'fifo' and 'file'."""
+    streamable = local_input_file.get('streamable')
+    if not streamable:
+        return None
+    if streamable is True:
+        return FIFO
+    if streamable in [FIFO, GROWING_FILE]:
+        return streamable
+    raise Exception('Value of streamable not valid: {}'.format(streamable))
+
+
+def prepare(local_file):
+    """Creates the named pipe or the empty growing file of a streamable input or result file, so that it exists when
+    the application starts."""
+    local_file_dir = local_file['dir']
+    if not os.path.exists(local_file_dir):
+        os.makedirs(local_file_dir)
+
+    local_file_path = os.path.join(local_file_dir, local_file['name'])
+    with _lock:
+        _released.discard(local_file_path)
+        _finished.pop(local_file_path, None)
+    for path in [local_file_path, local_file_path + COMPLETE_SUFFIX]:
+        if os.path.lexists(path):
+            os.remove(path)
+
+    if stream_type(local_file) == FIFO:
+        os.mkfifo(local_file_path)
+    else:
+        open(local_file_path, 'wb').close()
+
+
+def release(local_input_file):
+    """Stops the stream of a file, which is not consumed anymore, e.g. because the application exited."""
+    with _lock:
+        _released.add(os.path.join(local_input_file['dir'], local_input_file['name']))
+
+
+def stream(connector, input_file, local_input_file):
+    """Writes an input file sequentially into its named pipe or growing file while the application reads it.
+
+    Writing into a named pipe starts as soon as the application opens it for reading. A growing file is complete when
+    a file with the additional suffix .complete exists next to it. Interrupted HTTP and SFTP downloads are retried up
+    to max_retries times and continue at the last written byte. Other connectors download the complete file before
+    it is streamed. If the application closes the named pipe early, the stream stops without an error. Compressed
+    HTTP and SFTP sources selected by the decompress field are decompressed while they are streamed.
+    """
+    connector_type = input_file['connector_type']
+    connector_access = input_file['connector_access']
+    local_file_path = os.path.join(local_input_file['dir'], local_input_file['name'])
+    kind = stream_type(local_input_file)
+
+    algorithm = None
+    if connector_type == 'http':
+        algorithm = compression.for_download(connector_access, compression.url_file_name(connector_access['url']))
+    elif connector_type == 'ssh':
+        algorithm = compression.for_download(connector_access, connector_access['file_name'])
+
+    start = monotonic()
+    writer = _Writer(local_file_path, checksums.for_connector(connector_access), algorithm)
+    # every attempt continues after the bytes already written, which cannot be replaced if the source changed
+    state = {'validator': None}
+    fatal = (_SourceChanged, _Released, BrokenPipeError)
+    retries = 0
+    closed = False
+    try:
+        with _open(local_file_path, kind) as f:
+            writer.f = f
+            if connector_type == 'http':
+                retries = _with_retries(connector_access, None, lambda: _http(connector_access, writer, state), fatal)
+            elif connector_type == 'ssh':
+                retries = _with_retries(connector_access, None, lambda: _ssh(connector_access, writer, state), fatal)
+            else:
+                _download_and_copy(connector, connector_access, local_input_file, writer)
+            if writer.decompressor:
+                writer.decompressor.finish()
+    except (BrokenPipeError, _Released):
+        # the application did not read the whole file
+        closed = True
+
+    values = {'connector_type': connector_type, 'stream': kind, 'stream_closed': closed, 'retries': retries}
+    if writer.checksum:
+        values['checksum'] = writer.checksum.result()
+    if writer.decompressor:
+        values['compression'] = algorithm
+        values['compressed_bytes'] = writer.num_bytes
+        values['raw_bytes'] = writer.decompressor.num_bytes
+    stats.update('download', local_file_path, **values)
+    stats.record_throughput('download', local_file_path, writer.num_bytes, monotonic() - start)
+
+    if closed:
+        return
+    if writer.checksum:
+        writer.checksum.verify(local_file_path)
+    if kind == GROWING_FILE:
+        open(local_file_path + COMPLETE_SUFFIX, 'w').close()
+
+
+def _is_released(local_file_path):
+    with _lock:
+        return local_file_path in _released
+
+
+def _open(local_file_path, kind):
+    if kind == GROWING_FILE:
+        return open(local_file_path, 'ab')
+
+    # opening a named pipe for writing blocks until it is opened for reading, non-blocking attempts are polled
+    # instead, so that the stream can be released if the application never opens it
+    while True:
+        if _is_released(local_file_path):
+            raise _Released()
+        try:
+            fd = os.open(local_file_path, os.O_WRONLY | os.O_NONBLOCK)
+            break
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+        sleep(OPEN_POLL_SECONDS)
+    os.set_blocking(fd, True)
+    return os.fdopen(fd, 'wb')
+
+
+class _Writer:
+    """Writes the source bytes into the stream. num_bytes and the checksum refer to the source, which may be
+    decompressed on the way."""
+    def __init__(self, local_file_path, checksum=None, algorithm=None):
+        self.local_file_path = local_file_path
+        self.checksum = checksum
+        self.decompressor = compression.Decompressor(algorithm) if algorithm else None
+        self.f = None
+        self.num_bytes = 0
+
+    def write(self, data):
+        check_cancelled()
+        if _is_released(self.local_file_path):
+            raise _Released()
+        self.f.write(self.decompressor.decompress(data) if self.decompressor else data)
+        self.f.flush()
+        self.num_bytes += len(data)
+        if self.checksum:
+            self.checksum.update(data)
+
+
+def _http(connector_access, writer, state):
+    headers = {'Accept-Encoding': 'identity'}
+    if writer.num_bytes:
+        headers['Range'] = 'bytes={}-'.format(writer.num_bytes)
+        if state['validator']:
+            headers['If-Range'] = state['validator']
+
+    r = sessions.session(connector_access['url']).get(
+        connector_access['url'],
+        headers=headers,
+        auth=helper.auth(connector_access.get('auth')),
+        verify=connector_access.get('ssl_verify', True),
+        stream=True
+    )
+    with r:
+        r.raise_for_status()
+        if writer.num_bytes:
+            content_range = r.headers.get('Content-Range', '')
+            if r.status_code != 206 or not content_range.startswith('bytes {}-'.format(writer.num_bytes)):
+                # bytes which have already been streamed cannot be replaced
+                raise _SourceChanged('Server did not answer range request, the file may have changed.')
+        state['validator'] = state['validator'] or r.headers.get('ETag') or r.headers.get('Last-Modified')
+
+        # the body is not decoded, e.g. if a .gz file is sent with Content-Encoding gzip, to keep the byte positions
+        for chunk in r.raw.stream(connector_access.get('chunk_size', DEFAULT_CHUNK_SIZE), decode_content=False):
+            if chunk:
+                writer.write(chunk)
+
+
+def _ssh(connector_access, writer, state):
+    remote_file_path = os.path.join(connector_access['file_dir'], connector_access['file_name'])
+    with ssh_connections.open_sftp(connector_access) as sftp:
+        attributes = sftp.stat(remote_file_path)
+        validator = '{}:{}'.format(attributes.st_size, attributes.st_mtime)
+        if state['validator'] and state['validator'] != validator:
+            raise _SourceChanged('File changed while it was streamed.')
+        state['validator'] = validator
+
+        for data in ssh_connections.read(
+            sftp,
+            remote_file_path,
+            block_size=connector_access.get('block_size', ssh_connections.DEFAULT_BLOCK_SIZE),
+            max_requests=connector_access.get('max_requests'),
+            offset=writer.num_bytes
+        ):
+            writer.write(data)
+
+    if writer.num_bytes != attributes.st_size:
+        raise Exception('Received {} of {} bytes.'.format(writer.num_bytes, attributes.st_size))
+
+
+def _download_and_copy(connector, connector_access, local_input_file, writer):
+    download_file = {'dir': local_input_file['dir'], 'name': '.{}{}'.format(local_input_file['name'], DOWNLOAD_SUFFIX)}
+    download_file_path = os.path.join(download_file['dir'], download_file['name'])
+    try:
+        connector(connector_access, download_file)
+        stats.move('download', download_file_path, os.path.join(local_input_file['dir'], local_input_file['name']))
+        with open(download_file_path, 'rb') as f:
+            while True:
+                data = f.read(DEFAULT_CHUNK_SIZE)
+                if not data:
+                    break
+                writer.write(data)
+    finally:
+        if os.path.exists(download_file_path):
+            os.remove(download_file_path)
+
+
+def finish(local_result_file, aborted=False):
+    """Marks a streamed result file as complete after the application exited. If aborted, its upload is cancelled
+    instead."""
+    with _lock:
+        _finished[os.path.join(local_result_file['dir'], local_result_file['name'])] = aborted
+
+
+def upload(connector, connector_type, connector_access, local_result_file, meta_data):
+    """Uploads a result file while the application writes it into its named pipe or appends it to the growing file.
+    The upload is completed when finish is called.
+
+    Connectors with a stream function (see uploaders) receive the data as it is written, e.g. as chunked HTTP request
+    or as GridFS chunks. Other connectors upload the complete file after the application exited, data written to a
+    named pipe is collected in a hidden file in the meantime.
+    """
+    local_file_path = os.path.join(local_result_file['dir'], local_result_file['name'])
+    kind = stream_type(local_result_file)
+    checksum = checksums.for_connector(connector_access)
+    counter = {'bytes': 0}
+
+    def blocks():
+        for data in _follow(local_file_path, kind):
+            check_cancelled()
+            counter['bytes'] += len(data)
+            if checksum:
+                checksum.update(data)
+            yield data
+
+    start = monotonic()
+    stream_func = getattr(connector, 'stream', None)
+    try:
+        if stream_func:
+            stream_func(connector_access, blocks(), local_result_file, meta_data)
+        elif kind == GROWING_FILE:
+            for _ in blocks():
+                pass
+            connector(connector_access, local_result_file, meta_data)
+        else:
+            _collect_and_upload(connector, connector_access, local_result_file, meta_data, blocks())
+    except Exception as e:
+        if kind == FIFO and not isinstance(e, StreamAborted):
+            # the application would block on a full pipe
+            _drain(local_file_path)
+        raise
+
+    values = {'connector_type': connector_type, 'stream': kind}
+    if checksum:
+        values['checksum'] = checksum.result()
+    stats.update('upload', local_file_path, **values)
+    stats.record_throughput('upload', local_file_path, counter['bytes'], monotonic() - start)
+    if checksum:
+        checksum.verify(local_file_path)
+
+
+def _finish_state(local_file_path):
+    """Returns None while the application runs, otherwise whether the stream was aborted."""
+    with _lock:
+        return _finished.get(local_file_path)
+
+
+def _follow(local_file_path, kind):
+    """Yields the data written to a named pipe or appended to a growing file until the stream is finished."""
+    if kind == FIFO:
+        # a non-blocking pipe can be opened before the application opens it for writing
+        fd = os.open(local_file_path, os.O_RDONLY | os.O_NONBLOCK)
+    else:
+        fd = os.open(local_file_path, os.O_RDONLY)
+    try:
+        while True:
+            # the state is checked before reading, so that data written before the application exited is not missed
+            aborted = _finish_state(local_file_path)
+            if aborted:
+                raise StreamAborted('Upload of {} was aborted.'.format(local_file_path))
+            try:
+                data = os.read(fd, READ_SIZE)
+            except BlockingIOError:
+                data = None
+            if data:
+                yield data
+            elif aborted is not None:
+                return
+            else:
+                sleep(FOLLOW_POLL_SECONDS)
+    finally:
+        os.close(fd)
+
+
+def _drain(local_file_path):
+    try:
+        for _ in _follow(local_file_path, FIFO):
+            pass
+    except StreamAborted:
+        pass
+
+
+def _collect_and_upload(connector, connector_access, local_result_file, meta_data, blocks):
+    collect_file = {'dir': local_result_file['dir'], 'name': '.{}{}'.format(local_result_file['name'], UPLOAD_SUFFIX)}
+    collect_file_path = os.path.join(collect_file['dir'], collect_file['name'])
+    try:
+        with open(collect_file_path, 'wb') as f:
+            for data in blocks:
+                f.write(data)
+        connector(connector_access, collect_file, meta_data)
+        stats.move('upload', collect_file_path, os.path.join(local_result_file['dir'], local_result_file['name']))
+    finally:
+        if os.path.exists(collect_file_path):
+            os.remove(collect_file_path)
@@ -1,50 +1,115 @@
 import json
 import os
 import uuid
+from functools import partial
+from time import monotonic
 
-import gridfs
-import paramiko
-import pymongo
-import requests
-from bson.objectid import ObjectId
-
+from cc_container_worker.commons import checksums
+from cc_container_worker.commons import compression
 from cc_container_worker.commons import helper
+from cc_container_worker.commons import mongodb_clients
+from cc_container_worker.commons import sessions
+from cc_container_worker.commons import ssh_connections
+from cc_container_worker.commons import stats
+
+# default of MongoDB drivers, i.e. about 4000 chunk documents per GB instead of 250000 with 4 KiB chunks
+GRIDFS_CHUNK_SIZE = 255 * 1024
+DEFAULT_BATCH_SIZE = 1000
+READ_SIZE = 1024 * 1024
+
+# Connectors with a stream attribute can upload result files while the application writes them. The stream function
+# is called with connector_access, an iterable of data blocks, local_result_file and meta_data.
+
+# The http, http_json, mongodb_gridfs and ssh connectors compress the uploaded data, if the compression field of
+# connector_access is gzip, zstd or lz4. The optional compression_level is passed to the compressor.
 
 
 @helper.skip_optional
 def http(connector_access, local_result_file, meta_data):
     local_file_path = os.path.join(local_result_file['dir'], local_result_file['name'])
 
-    http_method = connector_access['method'].lower()
-    if http_method == 'put':
-        method_func = requests.put
-    elif http_method == 'post':
-        method_func = requests.post
-    else:
-        raise Exception('HTTP method not valid: {}'.format(connector_access['method']))
-
+    checksum = checksums.for_connector(connector_access)
+    algorithm = compression.for_upload(connector_access)
+    # the generator of compressed blocks cannot be rewound for a retry
+    method_func = _http_method_func(connector_access, retry_status=not algorithm)
+    counter = {}
     with open(local_file_path, 'rb') as f:
+        data = checksums.ChecksumReader(f, checksum) if checksum else f
+        if algorithm:
+            # requests sends iterables with chunked transfer encoding
+            data = _compress_blocks(connector_access, iter(partial(data.read, READ_SIZE), b''), counter)
         r = method_func(
             connector_access['url'],
-            data=f,
+            data=data,
+            headers=_content_encoding_headers(algorithm),
             auth=helper.auth(connector_access.get('auth')),
             verify=connector_access.get('ssl_verify', True)
         )
         r.raise_for_status()
+    _record_compression(local_file_path, 'http', algorithm, counter)
+    _verify_checksum(local_file_path, 'http', checksum)
+
+
+def _http_stream(connector_access, blocks, local_result_file, meta_data):
+    algorithm = compression.for_upload(connector_access)
+    counter = {}
+    if algorithm:
+        blocks = _compress_blocks(connector_access, blocks, counter)
+    # requests sends iterables with chunked transfer encoding, the blocks cannot be sent again for a retry
+    r = _http_method_func(connector_access, retry_status=False)(
+        connector_access['url'],
+        data=blocks,
+        headers=_content_encoding_headers(algorithm),
+        auth=helper.auth(connector_access.get('auth')),
+        verify=connector_access.get('ssl_verify', True)
+    )
+    r.raise_for_status()
+    _record_compression(_local_file_path(local_result_file), 'http', algorithm, counter)
+
+
+http.stream = _http_stream
+
+
+def _http_method_func(connector_access, retry_status=True):
+    session = sessions.session(connector_access['url'], retry_status)
+    http_method = connector_access['method'].lower()
+    if http_method == 'put':
+        return session.put
+    if http_method == 'post':
+        return session.post
+    raise Exception('HTTP method not valid: {}'.format(connector_access['method']))
 
 
 @helper.skip_optional
 def http_json(connector_access, local_result_file, meta_data):
     local_file_path = os.path.join(local_result_file['dir'], local_result_file['name'])
 
-    with open(local_file_path) as f:
-        data = json.load(f)
+    checksum = checksums.for_connector(connector_access)
+    data = _load_json(local_file_path, checksum)
+    _verify_checksum(local_file_path, 'http_json', checksum)
 
     if meta_data:
         for key, val in meta_data.items():
             data[key] = val
 
-    r = requests.post(
+    algorithm = compression.for_upload(connector_access)
+    if algorithm:
+        counter = {}
+        body = b''.join(_compress_blocks(connector_access, [json.dumps(data).encode('utf-8')], counter))
+        headers = _content_encoding_headers(algorithm)
+        headers['Content-Type'] = 'application/json'
+        r = sessions.session(connector_access['url']).post(
+            connector_access['url'],
+            data=body,
+            headers=headers,
+            auth=helper.auth(connector_access.get('auth')),
+            verify=connector_access.get('ssl_verify', True)
+        )
+        r.raise_for_status()
+        _record_compression(local_file_path, 'http_json', algorithm, counter)
+        return
+
+    r = sessions.session(connector_access['url']).post(
         connector_access['url'],
         json=data,
         auth=helper.auth(connector_access.get('auth')),
@@ -55,92 +120,264 @@ def http_json(connector_access, local_result_file, meta_data):
 
 @helper.skip_optional
 def mongodb_json(connector_access, local_result_file, meta_data):
+    """Inserts the JSON documents of the result file into a collection in batches of batch_size."""
     local_file_path = os.path.join(local_result_file['dir'], local_result_file['name'])
 
-    with open(local_file_path) as f:
-        data = json.load(f)
+    checksum = checksums.for_connector(connector_access)
+    if connector_access.get('json_lines'):
+        # the batches are inserted while the file is read, the checksum can only be verified afterwards
+        with open(local_file_path, 'rb') as f:
+            source = checksums.ChecksumReader(f, checksum) if checksum else f
+            _mongodb_insert(
+                connector_access, _json_lines(iter(partial(source.read, READ_SIZE), b'')), local_file_path, meta_data
+            )
+        _verify_checksum(local_file_path, 'mongodb_json', checksum)
+        return
+
+    data = _load_json(local_file_path, checksum)
+    _verify_checksum(local_file_path, 'mongodb_json', checksum)
+    _mongodb_insert(connector_access, data if isinstance(data, list) else [data], local_file_path, meta_data)
+
+
+def _mongodb_json_stream(connector_access, blocks, local_result_file, meta_data):
+    if connector_access.get('json_lines'):
+        documents = _json_lines(blocks)
+    else:
+        data = json.loads(b''.join(blocks).decode('utf-8'))
+        documents = data if isinstance(data, list) else [data]
+    _mongodb_insert(connector_access, documents, _local_file_path(local_result_file), meta_data)
+
+
+mongodb_json.stream = _mongodb_json_stream
+
+
+def _mongodb_insert(connector_access, documents, local_file_path, meta_data):
+    client = mongodb_clients.client(connector_access)
+    collection = client[connector_access['db']][connector_access['collection']]
+    batch_size = connector_access.get('batch_size', DEFAULT_BATCH_SIZE)
+    meta_data = _mongodb_meta_data(meta_data)
+
+    num_documents = 0
+    num_batches = 0
+    batch = []
+    for document in documents:
+        document.update(meta_data)
+        batch.append(document)
+        if len(batch) >= batch_size:
+            collection.insert_many(batch)
+            num_documents += len(batch)
+            num_batches += 1
+            batch = []
+    if batch:
+        collection.insert_many(batch)
+        num_documents += len(batch)
+        num_batches += 1
+
+    stats.update(
+        'upload', local_file_path, connector_type='mongodb_json', documents=num_documents, batches=num_batches
+    )
+
+
+def _json_lines(blocks):
+    """Parses JSON Lines from an iterable of data blocks. Blank lines are skipped."""
+    rest = b''
+    for data in blocks:
+        lines = (rest + data).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield json.loads(line.decode('utf-8'))
+    if rest.strip():
+        yield json.loads(rest.decode('utf-8'))
+
 
+def _mongodb_meta_data(meta_data):
+    """Converts meta data values, which are valid ObjectIds, to lists containing the ObjectId."""
+    from bson.objectid import ObjectId
+    result = {}
     if meta_data:
         for key, val in meta_data.items():
             try:
-                data[key] = [ObjectId(val)]
+                result[key] = [ObjectId(val)]
             except:
-                data[key] = val
-
-    client = _mongodb_client(connector_access)
-    db = client[connector_access['db']]
-    db[connector_access['collection']].insert_one(data)
-    client.close()
+                result[key] = val
+    return result
 
 
 @helper.skip_optional
 def mongodb_gridfs(connector_access, local_result_file, meta_data):
     local_file_path = os.path.join(local_result_file['dir'], local_result_file['name'])
 
-    client = _mongodb_client(connector_access)
-    db = client[connector_access['db']]
-    fs = gridfs.GridFSBucket(db)
+    fs = _gridfs_bucket(connector_access)
+
+    checksum = checksums.for_connector(connector_access)
+    algorithm = compression.for_upload(connector_access)
+    reader = None
+    with open(local_file_path, 'rb') as f:
+        source = checksums.ChecksumReader(f, checksum) if checksum else f
+        if algorithm:
+            reader = compression.CompressingReader(source, algorithm, connector_access.get('compression_level'))
+        fs.upload_from_stream(
+            connector_access.get('file_name', str(uuid.uuid4())),
+            reader or source,
+            chunk_size_bytes=connector_access.get('chunk_size', GRIDFS_CHUNK_SIZE),
+            metadata=_gridfs_metadata(connector_access, meta_data)
+        )
+    _record_compression(local_file_path, 'mongodb_gridfs', algorithm, reader.counter if reader else None)
+    _verify_checksum(local_file_path, 'mongodb_gridfs', checksum)
+
+
+def _mongodb_gridfs_stream(connector_access, blocks, local_result_file, meta_data):
+    algorithm = compression.for_upload(connector_access)
+    counter = {}
+    if algorithm:
+        blocks = _compress_blocks(connector_access, blocks, counter)
+    fs = _gridfs_bucket(connector_access)
+    grid_in = fs.open_upload_stream(
+        connector_access.get('file_name', str(uuid.uuid4())),
+        chunk_size_bytes=connector_access.get('chunk_size', GRIDFS_CHUNK_SIZE),
+        metadata=_gridfs_metadata(connector_access, meta_data)
+    )
+    try:
+        for data in blocks:
+            grid_in.write(data)
+    except:
+        # removes the chunks written so far
+        grid_in.abort()
+        raise
+    grid_in.close()
+    _record_compression(_local_file_path(local_result_file), 'mongodb_gridfs', algorithm, counter)
+
 
+mongodb_gridfs.stream = _mongodb_gridfs_stream
+
+
+def _gridfs_bucket(connector_access):
+    # pymongo and gridfs are only imported by tasks using MongoDB
+    import gridfs
+    return gridfs.GridFSBucket(mongodb_clients.client(connector_access)[connector_access['db']])
+
+
+def _gridfs_metadata(connector_access, meta_data):
     md = connector_access.get('metadata')
     if meta_data:
         if not md:
             md = {}
-        for key, val in meta_data.items():
-            try:
-                md[key] = [ObjectId(val)]
-            except:
-                md[key] = val
+        md.update(_mongodb_meta_data(meta_data))
+    algorithm = compression.for_upload(connector_access)
+    if algorithm:
+        md = dict(md or {})
+        md['compression'] = algorithm
+    return md
+
+
+def _local_file_path(local_result_file):
+    return os.path.join(local_result_file['dir'], local_result_file['name'])
+
+
+def _compress_blocks(connector_access, blocks, counter):
+    return compression.compress_blocks(
+        blocks, connector_access['compression'], connector_access.get('compression_level'), counter
+    )
+
+
+def _content_encoding_headers(algorithm):
+    content_encoding = compression.CONTENT_ENCODINGS.get(algorithm)
+    if content_encoding:
+        return {'Content-Encoding': content_encoding}
+    return {}
 
+
+def _record_compression(local_file_path, connector_type, algorithm, counter):
+    """Reports the raw and compressed size of a compressed upload."""
+    if not algorithm:
+        return
+    stats.update(
+        'upload',
+        local_file_path,
+        connector_type=connector_type,
+        compression=algorithm,
+        raw_bytes=counter['bytes'],
+        compressed_bytes=counter['compressed_bytes'],
+        compression_ratio=counter['bytes'] / counter['compressed_bytes'] if counter['compressed_bytes'] else None
+    )
+
+
+def _load_json(local_file_path, checksum):
     with open(local_file_path, 'rb') as f:
-        fs.upload_from_stream(
-            connector_access.get('file_name', str(uuid.uuid4())),
-            f,
-            chunk_size_bytes=4096,
-            metadata=md
-        )
-    client.close()
-
-
-def _mongodb_client(connector_access):
-    url_parameters = ''
-    enable_ssl = connector_access.get('enable_ssl', True)
-    ssl_verify = connector_access.get('ssl_verify', True)
-    ssl_ca_cert_path = connector_access.get('ssl_ca_cert_path')
-    if enable_ssl:
-        url_parameters = '?ssl=true'
-        if ssl_ca_cert_path:
-            url_parameters = '{}&ssl_ca_certs={}'.format(url_parameters, ssl_ca_cert_path)
-        elif not ssl_verify:
-            url_parameters = '{}&ssl_cert_reqs=CERT_NONE'.format(url_parameters)
-
-    return pymongo.MongoClient('mongodb://{}:{}@{}:{}/{}{}'.format(
-        connector_access['username'],
-        connector_access['password'],
-        connector_access['host'],
-        connector_access.get('port', 27017),
-        connector_access['db'],
-        url_parameters
-    ))
+        raw = f.read()
+    if checksum:
+        checksum.update(raw)
+    return json.loads(raw.decode('utf-8'))
+
+
+def _verify_checksum(local_file_path, connector_type, checksum):
+    """Reports the checksum computed while reading the uploaded file and compares it with the declared one."""
+    if not checksum:
+        return
+    stats.update('upload', local_file_path, connector_type=connector_type, checksum=checksum.result())
+    checksum.verify(local_file_path)
 
 
 @helper.skip_optional
 def ssh(connector_access, local_result_file, meta_data):
     local_file_path = os.path.join(local_result_file['dir'], local_result_file['name'])
 
-    with paramiko.SSHClient() as client:
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(
-            connector_access['host'],
-            port=connector_access.get('port', 22),
-            username=connector_access['username'],
-            password=connector_access['password']
-        )
-        with client.open_sftp() as sftp:
-            _ssh_mkdir(sftp, connector_access['file_dir'])
-            sftp.put(
+    checksum = checksums.for_connector(connector_access)
+    algorithm = compression.for_upload(connector_access)
+    counter = {}
+    block_size = connector_access.get('block_size', ssh_connections.DEFAULT_BLOCK_SIZE)
+    remote_file_path = os.path.join(connector_access['file_dir'], connector_access['file_name'])
+    with ssh_connections.open_sftp(connector_access) as sftp:
+        _ssh_mkdir(sftp, connector_access['file_dir'])
+        start = monotonic()
+        if algorithm:
+            with open(local_file_path, 'rb') as f:
+                source = checksums.ChecksumReader(f, checksum) if checksum else f
+                blocks = _compress_blocks(connector_access, iter(partial(source.read, block_size), b''), counter)
+                ssh_connections.write(sftp, blocks, remote_file_path, block_size)
+            num_bytes = counter['bytes']
+        else:
+            num_bytes = ssh_connections.put(
+                sftp,
                 local_file_path,
-                os.path.join(connector_access['file_dir'], connector_access['file_name'])
+                remote_file_path,
+                block_size=block_size,
+                progress=checksum.update if checksum else None
             )
+        seconds = monotonic() - start
+
+    stats.update('upload', local_file_path, connector_type='ssh')
+    stats.record_throughput('upload', local_file_path, num_bytes, seconds)
+    _record_compression(local_file_path, 'ssh', algorithm, counter)
+    _verify_checksum(local_file_path, 'ssh', checksum)
+
+
+def _ssh_stream(connector_access, blocks, local_result_file, meta_data):
+    remote_file_path = os.path.join(connector_access['file_dir'], connector_access['file_name'])
+    algorithm = compression.for_upload(connector_access)
+    counter = {}
+    if algorithm:
+        blocks = _compress_blocks(connector_access, blocks, counter)
+    with ssh_connections.open_sftp(connector_access) as sftp:
+        _ssh_mkdir(sftp, connector_access['file_dir'])
+        try:
+            ssh_connections.write(
+                sftp,
+                blocks,
+                remote_file_path,
+                block_size=connector_access.get('block_size', ssh_connections.DEFAULT_BLOCK_SIZE)
+            )
+        except:
+            try:
+                sftp.remove(remote_file_path)
+            except IOError:
+                pass
+            raise
+    _record_compression(_local_file_path(local_result_file), 'ssh', algorithm, counter)
+
+
+ssh.stream = _ssh_stream
 
 
 def _ssh_mkdir(sftp, remote_directory):
@@ -155,6 +392,10 @@ def _ssh_mkdir(sftp, remote_directory):
     except IOError:
         dirname, basename = os.path.split(remote_directory.rstrip('/'))
         _ssh_mkdir(sftp, dirname)
-        sftp.mkdir(basename)
+        try:
+            sftp.mkdir(basename)
+        except IOError:
+            # the directory may have been created by a concurrent upload
+            pass
         sftp.chdir(basename)
         return True
@@ -1,31 +1,37 @@
+import os
 import sys
 import json
-from multiprocessing import cpu_count
+import shutil
 from traceback import format_exc
-from gunicorn import util
-from gunicorn.app.base import BaseApplication
 
+from cc_container_worker.commons import sessions
+from cc_container_worker.commons import stats
 from cc_container_worker.commons.callbacks import CallbackHandler
-from cc_container_worker.commons.data import dc_download
+from cc_container_worker.commons.data import dc_download, dc_lazy
 
+METRICS_DIR = '/var/tmp/cc-metrics'
 
-class WebApp(BaseApplication):
-    def __init__(self, options=None):
-        self.options = options or {}
-        super(WebApp, self).__init__()
 
-    def load_config(self):
-        config = dict([(key, value) for key, value in self.options.items()
-                       if key in self.cfg.settings and value is not None])
-        for key, value in config.items():
-            self.cfg.set(key.lower(), value)
+def _prepare_metrics_dir():
+    """The gunicorn workers share their Prometheus metrics through files in this directory."""
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    os.makedirs(METRICS_DIR)
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = METRICS_DIR
 
-    def load(self):
-        return util.import_app("cc_container_worker.data_container.wsgi")
+
+def _child_exit(server, worker):
+    """gunicorn child_exit hook"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
 
 
 def main():
     settings = json.loads(sys.argv[1])
+    sessions.configure(
+        pool_size=settings.get('http_pool_size'),
+        max_retries=settings.get('http_max_retries'),
+        timeout=settings.get('http_timeout')
+    )
     callback_handler = CallbackHandler(settings, container_type='data')
 
     description = 'Container started.'
@@ -38,28 +44,65 @@ def main():
         callback_handler.send_callback(
             callback_type='files_retrieved', state='failed', description=description
         )
+        callback_handler.flush()
         exit(2)
 
+    lazy = additional_settings.get('lazy_download')
     try:
-        dc_download(additional_settings['input_files'], additional_settings['input_file_keys'])
+        if lazy:
+            dc_lazy(
+                additional_settings['input_files'],
+                additional_settings['input_file_keys'],
+                prefetch=additional_settings.get('prefetch', False)
+            )
+        else:
+            with stats.span('stage_in', files=len(additional_settings['input_files'])):
+                dc_download(
+                    additional_settings['input_files'],
+                    additional_settings['input_file_keys'],
+                    max_workers=additional_settings.get('max_parallel_downloads'),
+                    max_workers_per_host=additional_settings.get('max_parallel_downloads_per_host'),
+                    input_cache=additional_settings.get('input_cache')
+                )
     except:
         description = 'Could not retrieve input files.'
         callback_handler.send_callback(
             callback_type='files_retrieved', state='failed', description=description, exception=format_exc()
         )
+        callback_handler.flush()
         exit(3)
 
     description = 'Input files available.'
-    callback_handler.send_callback(callback_type='files_retrieved', state='success', description=description)
+    if lazy:
+        description = 'Input files are downloaded on request.'
+    callback_handler.send_callback(
+        callback_type='files_retrieved',
+        state='success',
+        description=description,
+        telemetry={'transfers': stats.transfers(), 'spans': stats.spans()}
+    )
+    # the data container must not serve files, if the server does not know that they are available
+    callback_handler.flush()
+
+    # gunicorn and werkzeug are imported once the input files are available, they are not needed before
+    from cc_container_worker.data_container import memory
+    from cc_container_worker.data_container.serving import WebApp, enable_gevent_sendfile
+
+    memory.prepare(additional_settings.get('memory_tier'))
 
     num_workers = additional_settings.get('num_workers')
     if not num_workers:
-        num_workers = cpu_count()
+        num_workers = os.cpu_count() or 1
+
+    _prepare_metrics_dir()
 
     options = {
         'bind': '0.0.0.0:80',
         'workers': num_workers,
-        'worker_class': 'gevent'
+        'worker_class': 'gevent',
+        'sendfile': True,
+        'post_worker_init': enable_gevent_sendfile,
+        'child_exit': _child_exit
     }
 
     WebApp(options).run()
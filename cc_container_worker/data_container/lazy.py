@@ -0,0 +1,154 @@
+import fcntl
+import json
+import os
+from threading import Thread
+from time import sleep
+from traceback import print_exc
+
+from cc_container_worker.commons import stats
+from cc_container_worker.commons import streaming
+from cc_container_worker.commons.connectors import DOWNLOADERS
+
+FETCH_SUFFIX = '.fetch'
+LOCK_SUFFIX = '.lock'
+RECORD_SUFFIX = '.json'
+POLL_SECONDS = 0.05
+READ_SIZE = 1024 * 1024
+
+# Input files of a lazy data container are downloaded by the gunicorn workers when they are requested first. The
+# worker holding the file lock of an input file appends it to a growing file with the suffix .fetch and renames it to
+# the local input file when it is complete. Other requests, also in other workers, read the growing file meanwhile.
+
+
+def _path(file, suffix=''):
+    local_input_file = file['local_input_file']
+    return os.path.join(local_input_file['dir'], local_input_file['name']) + suffix
+
+
+def _inode(path):
+    try:
+        return os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
+
+
+def start(file):
+    """Starts the download of an input file in a background thread, unless it is complete or downloaded by another
+    request or worker. Returns the thread or None."""
+    if os.path.isfile(_path(file)):
+        return None
+
+    lock = open(_path(file, LOCK_SUFFIX), 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        if os.path.isfile(_path(file)):
+            lock.close()
+            return None
+        # the file of a failed download is replaced, so that its readers notice the failure
+        fetch_path = _path(file, FETCH_SUFFIX)
+        if os.path.lexists(fetch_path):
+            os.remove(fetch_path)
+        open(fetch_path, 'wb').close()
+    except BlockingIOError:
+        lock.close()
+        return None
+    except:
+        lock.close()
+        raise
+
+    t = Thread(target=_fetch, args=(file, lock))
+    t.start()
+    return t
+
+
+def _fetch(file, lock):
+    """Downloads the file while holding the lock. Failures are only printed, the next request starts a new download."""
+    input_file = file['input_file']
+    local_file_path = _path(file)
+    fetch_path = _path(file, FETCH_SUFFIX)
+    fetch_file = dict(file['local_input_file'], streamable=streaming.GROWING_FILE)
+    fetch_file['name'] += FETCH_SUFFIX
+
+    with lock:
+        try:
+            streaming.stream(DOWNLOADERS.get(input_file['connector_type']), input_file, fetch_file)
+            os.remove(fetch_path + streaming.COMPLETE_SUFFIX)
+            stats.move('download', fetch_path, local_file_path)
+            with open(_path(file, RECORD_SUFFIX), 'w') as f:
+                json.dump(_download_record(local_file_path), f)
+            # readers of the growing file stop when it has been renamed
+            os.rename(fetch_path, local_file_path)
+        except:
+            print_exc()
+            if os.path.lexists(fetch_path):
+                os.remove(fetch_path)
+
+
+def _download_record(local_file_path):
+    for r in stats.transfers():
+        if r['direction'] == 'download' and r['local_file_path'] == local_file_path:
+            return r
+    return None
+
+
+def stream(file):
+    """Returns None if the input file is complete. Otherwise its download is started if necessary and a generator is
+    returned, which yields the bytes of the file as they arrive. The generator raises an exception if the download
+    fails."""
+    while True:
+        if os.path.isfile(_path(file)):
+            return None
+        start(file)
+        try:
+            fd = os.open(_path(file, FETCH_SUFFIX), os.O_RDONLY)
+        except FileNotFoundError:
+            # another worker has just locked the file, or its download has just finished or failed
+            sleep(POLL_SECONDS)
+            continue
+        return _follow(fd, _path(file, FETCH_SUFFIX), _path(file))
+
+
+def _follow(fd, fetch_path, local_file_path):
+    try:
+        inode = os.fstat(fd).st_ino
+        while True:
+            # the state is checked before reading, so that data written before the rename is not missed
+            complete = _inode(local_file_path) == inode
+            data = os.read(fd, READ_SIZE)
+            if data:
+                yield data
+            elif complete:
+                return
+            elif inode not in [_inode(fetch_path), _inode(local_file_path)]:
+                raise Exception('Download of {} failed.'.format(local_file_path))
+            else:
+                sleep(POLL_SECONDS)
+    finally:
+        os.close(fd)
+
+
+def wait(file):
+    """Waits until the input file is complete. Raises an exception if its download fails."""
+    blocks = stream(file)
+    if blocks is not None:
+        for _ in blocks:
+            pass
+
+
+def prefetch(files):
+    """Downloads the input files one after another in the order of their priority. Every gunicorn worker runs a
+    prefetch thread and skips the files downloaded by other workers, so up to num_workers files are prefetched in
+    parallel. Requested files are downloaded immediately, regardless of their priority."""
+    for file in sorted(files, key=lambda f: f['fetch']['priority']):
+        t = start(file)
+        if t is not None:
+            t.join()
+
+
+def record(file):
+    """Returns the download record of a complete input file or None."""
+    try:
+        with open(_path(file, RECORD_SUFFIX)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,141 @@
+import json
+import mmap
+import os
+from threading import Lock
+
+from cc_container_worker.commons.data import FILES_INFO_PATH
+from cc_container_worker.data_container.serving import file_headers
+
+SETTINGS_PATH = os.path.expanduser('~/memory_tier.json')
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+DEFAULT_MAX_FILE_SIZE = 16 * 1024 * 1024
+# mapped files are sent in blocks, so that a request does not copy the whole file into the memory of the worker
+BLOCK_SIZE = 256 * 1024
+
+# requests with these headers are answered by the application from the file on disk
+CONDITIONAL_HEADERS = [
+    'HTTP_RANGE', 'HTTP_IF_RANGE', 'HTTP_IF_MATCH', 'HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE',
+    'HTTP_IF_UNMODIFIED_SINCE'
+]
+
+
+def _path(file):
+    return os.path.join(file['local_input_file']['dir'], file['local_input_file']['name'])
+
+
+def prepare(memory_tier):
+    """Stores the memory_tier settings for the gunicorn workers and preloads the files of its hot_keys into the page
+    cache, like vmtouch -t. The page cache is shared by all workers, the kernel reads the files asynchronously."""
+    with open(SETTINGS_PATH, 'w') as f:
+        json.dump(memory_tier, f)
+    if not memory_tier or not hasattr(os, 'posix_fadvise'):
+        return
+
+    with open(FILES_INFO_PATH) as f:
+        files = json.load(f)
+    for key in memory_tier.get('hot_keys', []):
+        file = files.get(key)
+        if file is None or not os.path.isfile(_path(file)):
+            # e.g. the files of a lazy data container, which are downloaded on request
+            continue
+        with open(_path(file), 'rb') as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+
+
+def load_settings():
+    try:
+        with open(SETTINGS_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class _Entry:
+    def __init__(self, file_path, download_name):
+        with open(file_path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            self.size = st.st_size
+            # an empty file cannot be mapped
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        if self.size and hasattr(mmap, 'MADV_WILLNEED'):
+            self.data.madvise(mmap.MADV_WILLNEED)
+        headers = file_headers(st, download_name)[0]
+        headers['Content-Length'] = str(self.size)
+        self.headers = list(headers.items())
+
+
+class MemoryTier:
+    """Small input files, which are mapped into the memory of a gunicorn worker on their first request.
+
+    The files are mapped read-only, therefore all workers share the same pages of the page cache. Files larger than
+    max_file_size are not mapped, and the files of one worker are limited to max_size bytes. The files of hot_keys are
+    mapped first, other files in the order of their requests.
+    """
+    def __init__(self, files, max_size=None, max_file_size=None, hot_keys=None):
+        self.files = files
+        self.max_size = max_size or DEFAULT_MAX_SIZE
+        self.max_file_size = max_file_size or DEFAULT_MAX_FILE_SIZE
+        self.size = 0
+        self._lock = Lock()
+        self._entries = {}
+        self._rejected = set()
+        for key in hot_keys or []:
+            if key in files:
+                self.get(key)
+
+    def get(self, key):
+        """Returns the entry of a mapped file or None."""
+        entry = self._entries.get(key)
+        if entry is not None or key in self._rejected:
+            return entry
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None or key in self._rejected:
+                return entry
+            file_path = _path(self.files[key])
+            if not os.path.isfile(file_path):
+                # the file of a lazy data container has not been downloaded yet
+                return None
+            size = os.path.getsize(file_path)
+            if size > self.max_file_size or self.size + size > self.max_size:
+                self._rejected.add(key)
+                return None
+            entry = _Entry(file_path, self.files[key]['local_input_file']['name'])
+            self._entries[key] = entry
+            self.size += entry.size
+            return entry
+
+
+class MemoryTierMiddleware:
+    """WSGI middleware, which answers GET and HEAD requests of mapped files without the application. Range and
+    conditional requests are passed to the application. observe is called with the file key and whether the request
+    was answered from memory."""
+    def __init__(self, app, tier, observe):
+        self.app = app
+        self.tier = tier
+        self.observe = observe
+
+    def __call__(self, environ, start_response):
+        key = environ.get('PATH_INFO', '').strip('/')
+        method = environ.get('REQUEST_METHOD')
+        if key not in self.tier.files or method not in ['GET', 'HEAD']:
+            return self.app(environ, start_response)
+
+        entry = None
+        if not any(environ.get(header) for header in CONDITIONAL_HEADERS):
+            entry = self.tier.get(key)
+        self.observe(key, entry is not None, self.tier.size)
+        if entry is None:
+            return self.app(environ, start_response)
+
+        start_response('200 OK', entry.headers)
+        if method == 'HEAD':
+            return []
+        return _blocks(entry)
+
+
+def _blocks(entry):
+    for offset in range(0, entry.size, BLOCK_SIZE):
+        yield entry.data[offset:offset + BLOCK_SIZE]
@@ -0,0 +1,192 @@
+from functools import partial
+from time import monotonic
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from werkzeug.wsgi import ClosingIterator
+
+from cc_container_worker.data_container import lazy
+
+# prometheus_client chooses its multiprocess storage on import. This module must therefore only be imported in the
+# gunicorn workers, after PROMETHEUS_MULTIPROC_DIR has been set.
+
+MIB = 1024 * 1024
+MIN_THROUGHPUT_BYTES = MIB
+
+REQUESTS = Counter(
+    'cc_data_container_requests', 'HTTP requests by file key, method and status.', ['key', 'method', 'status']
+)
+RESPONSE_BYTES = Counter(
+    'cc_data_container_response_bytes', 'Bytes of successful GET response bodies by file key.', ['key']
+)
+IN_PROGRESS = Gauge(
+    'cc_data_container_requests_in_progress', 'Requests which are currently served.', multiprocess_mode='livesum'
+)
+RESPONSE_SECONDS = Histogram(
+    'cc_data_container_response_seconds', 'Time until the response body has been sent by file key.', ['key'],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, float('inf'))
+)
+RESPONSE_THROUGHPUT = Histogram(
+    'cc_data_container_response_throughput_bytes_per_second',
+    'Throughput of successful GET responses with at least 1 MiB by file key.', ['key'],
+    buckets=tuple(MIB * 2 ** i for i in range(0, 12, 2)) + (float('inf'),)
+)
+MEMORY_TIER_REQUESTS = Counter(
+    'cc_data_container_memory_tier_requests',
+    'GET and HEAD requests by file key and whether they were answered from the memory tier (hit or miss).',
+    ['key', 'result']
+)
+MEMORY_TIER_BYTES = Gauge(
+    'cc_data_container_memory_tier_bytes', 'Size of the files mapped into memory by the largest worker.',
+    multiprocess_mode='max'
+)
+
+
+def observe_memory_tier(key, hit, size):
+    """observe function of the MemoryTierMiddleware"""
+    MEMORY_TIER_REQUESTS.labels(key, 'hit' if hit else 'miss').inc()
+    MEMORY_TIER_BYTES.set(size)
+
+
+class MetricsMiddleware:
+    """WSGI middleware, which records every request when its response body has been sent.
+
+    File responses are returned unchanged, so that gunicorn still transmits them with sendfile. In this case the
+    measurement ends in the close method of the file wrapper, which the server calls after the transmission.
+    """
+    def __init__(self, app, keys):
+        self.app = app
+        self.keys = keys
+
+    def __call__(self, environ, start_response):
+        start = monotonic()
+        key = environ.get('PATH_INFO', '').strip('/')
+        if key not in self.keys:
+            # unknown paths share one label, so that they cannot create arbitrary many time series
+            key = ''
+        method = environ.get('REQUEST_METHOD')
+        response = {'status': '500', 'length': 0, 'chunked': True}
+
+        def _start_response(status, headers, exc_info=None):
+            response['status'] = status.split(' ', 1)[0]
+            for name, value in headers:
+                if name.lower() == 'content-length':
+                    response['length'] = int(value)
+                    response['chunked'] = False
+            return start_response(status, headers, exc_info)
+
+        def _observe():
+            seconds = monotonic() - start
+            IN_PROGRESS.dec()
+            REQUESTS.labels(key, method, response['status']).inc()
+            RESPONSE_SECONDS.labels(key).observe(seconds)
+            if method == 'GET' and response['status'] in ['200', '206']:
+                RESPONSE_BYTES.labels(key).inc(response['length'])
+                if response['length'] >= MIN_THROUGHPUT_BYTES and seconds > 0:
+                    RESPONSE_THROUGHPUT.labels(key).observe(response['length'] / seconds)
+
+        IN_PROGRESS.inc()
+        try:
+            app_iter = self.app(environ, _start_response)
+        except:
+            _observe()
+            raise
+
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None and isinstance(app_iter, file_wrapper) and hasattr(app_iter, 'close'):
+            app_iter.close = partial(_close_and_observe, app_iter.close, _observe)
+            return app_iter
+        if response['chunked']:
+            # e.g. files of a lazy data container, which are still being downloaded
+            app_iter = _count_bytes(app_iter, response)
+        return ClosingIterator(app_iter, _observe)
+
+
+def _count_bytes(app_iter, response):
+    try:
+        for data in app_iter:
+            response['length'] += len(data)
+            yield data
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+
+
+def _close_and_observe(close, observe):
+    try:
+        close()
+    finally:
+        observe()
+
+
+class DownloadCollector:
+    """Exposes the download records of the input files, which dc_download stored in the files info. The records of a
+    lazy data container are stored next to the input files when their download is complete."""
+    def __init__(self, files):
+        self.files = files
+
+    def collect(self):
+        gauges = [
+            ('bytes', 'Size of the downloaded input file by file key.'),
+            ('seconds', 'Download time of the input file by file key.'),
+            ('throughput', 'Download throughput of the input file in bytes per second by file key.'),
+            ('retries', 'Number of retried download attempts by file key.'),
+            ('cache_bytes_saved', 'Bytes taken from the input cache instead of downloading them by file key.')
+        ]
+        families = []
+        for field, documentation in gauges:
+            family = GaugeMetricFamily('cc_data_container_download_{}'.format(field), documentation, labels=['key'])
+            for key, file in self.files.items():
+                record = _download_record(file)
+                if record.get(field) is not None:
+                    family.add_metric([key], record[field])
+            families.append(family)
+
+        info = GaugeMetricFamily(
+            'cc_data_container_download_info', 'Connector type and input cache usage by file key.',
+            labels=['key', 'connector_type', 'cache']
+        )
+        for key, file in self.files.items():
+            record = _download_record(file)
+            info.add_metric([key, file['input_file']['connector_type'], record.get('cache') or ''], 1)
+        families.append(info)
+        return families
+
+
+def _download_record(file):
+    if file.get('fetch'):
+        return lazy.record(file) or {}
+    return file.get('download') or {}
+
+
+class MemoryTierCollector:
+    """Computes the hit ratio of the memory tier by file key from the request counters of all workers."""
+    def __init__(self, collector):
+        self.collector = collector
+
+    def collect(self):
+        counts = {}
+        for family in self.collector.collect():
+            if family.name != 'cc_data_container_memory_tier_requests':
+                continue
+            for sample in family.samples:
+                if sample.name.endswith('_total'):
+                    count = counts.setdefault(sample.labels['key'], {'hit': 0, 'miss': 0})
+                    count[sample.labels['result']] += sample.value
+
+        ratio = GaugeMetricFamily(
+            'cc_data_container_memory_tier_hit_ratio', 'Share of requests answered from the memory tier by file key.',
+            labels=['key']
+        )
+        for key, count in sorted(counts.items()):
+            ratio.add_metric([key], count['hit'] / (count['hit'] + count['miss']))
+        return [ratio]
+
+
+def generate(files):
+    """Returns the metrics of all gunicorn workers and the download records in the Prometheus text format."""
+    registry = CollectorRegistry()
+    collector = multiprocess.MultiProcessCollector(registry)
+    registry.register(DownloadCollector(files))
+    registry.register(MemoryTierCollector(collector))
+    return generate_latest(registry)
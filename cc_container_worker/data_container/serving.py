@@ -0,0 +1,178 @@
+import io
+import os
+import socket
+from datetime import datetime, timezone
+
+from gunicorn import util
+from gunicorn.app.base import BaseApplication
+from werkzeug.http import http_date, is_resource_modified, quote_etag
+from werkzeug.wrappers import Response
+
+BLOCK_SIZE = 1024 * 1024
+LARGE_FILE_SIZE = 64 * 1024 * 1024
+
+
+def send_file(request, file_path, download_name):
+    """Serves a file with support for HEAD, Range, If-Range and conditional requests.
+
+    The body is the server's wsgi.file_wrapper positioned at the start of the requested range, so that gunicorn
+    transmits it with sendfile.
+    """
+    f = open(file_path, 'rb')
+    try:
+        st = os.fstat(f.fileno())
+        headers, etag, last_modified = file_headers(st, download_name)
+
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            f.close()
+            return Response(status=304, headers=headers)
+
+        start = 0
+        length = st.st_size
+        status = 200
+        byte_range = request.range
+        if byte_range is not None and byte_range.units == 'bytes' and len(byte_range.ranges) == 1 \
+                and _if_range_matches(request, etag, last_modified):
+            r = byte_range.range_for_length(st.st_size)
+            if r is None:
+                f.close()
+                headers['Content-Range'] = 'bytes */{}'.format(st.st_size)
+                return Response(status=416, headers=headers)
+            start, stop = r
+            length = stop - start
+            status = 206
+            headers['Content-Range'] = byte_range.to_content_range_header(st.st_size)
+
+        headers['Content-Length'] = str(length)
+        if request.method == 'HEAD':
+            f.close()
+            return Response(status=status, headers=headers)
+
+        if length >= LARGE_FILE_SIZE and hasattr(os, 'posix_fadvise'):
+            # doubles the readahead window of the kernel for the sequential transmission
+            os.posix_fadvise(f.fileno(), start, length, os.POSIX_FADV_SEQUENTIAL)
+        f.seek(start)
+        file_wrapper = request.environ.get('wsgi.file_wrapper')
+        if file_wrapper:
+            # the server stops after Content-Length bytes
+            body = file_wrapper(f, BLOCK_SIZE)
+        else:
+            body = _read_range(f, length)
+        return Response(body, status=status, headers=headers, direct_passthrough=True)
+    except:
+        f.close()
+        raise
+
+
+def file_headers(st, download_name):
+    """Returns the response headers of a file with the given os.stat_result, its ETag and its modification time."""
+    etag = '{:x}-{:x}'.format(st.st_mtime_ns, st.st_size)
+    last_modified = datetime.fromtimestamp(int(st.st_mtime), tz=timezone.utc)
+    headers = {
+        'Content-Type': 'application/octet-stream',
+        'Content-Disposition': 'attachment; filename={}'.format(download_name),
+        'Accept-Ranges': 'bytes',
+        'ETag': quote_etag(etag),
+        'Last-Modified': http_date(last_modified)
+    }
+    return headers, etag, last_modified
+
+
+def send_stream(blocks, download_name):
+    """Serves the bytes of a file, which is still being downloaded. The length is unknown, therefore the body is sent
+    chunked and ranges are not supported."""
+    headers = {
+        'Content-Type': 'application/octet-stream',
+        'Content-Disposition': 'attachment; filename={}'.format(download_name)
+    }
+    return Response(blocks, status=200, headers=headers, direct_passthrough=True)
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.if_range
+    if if_range.etag is None and if_range.date is None:
+        return True
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    return if_range.date == last_modified
+
+
+def _read_range(f, length):
+    with f:
+        while length > 0:
+            data = f.read(min(BLOCK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def _gevent_sendfile(self, file, offset=0, count=None):
+    """Replacement for the sendfile method of gevent sockets, which always reads and sends the file in Python."""
+    try:
+        return _cooperative_sendfile(self, file, offset, count)
+    except socket._GiveupOnSendfile:
+        return self._sendfile_use_send(file, offset, count)
+
+
+def _cooperative_sendfile(self, file, offset=0, count=None):
+    """Sends the file with os.sendfile. The socket is non-blocking, so the greenlet waits for it to become writable
+    whenever the socket buffer is full."""
+    from gevent.socket import wait_write
+
+    self._check_sendfile_params(file, offset, count)
+    sockno = self.fileno()
+    try:
+        fileno = file.fileno()
+        file_size = os.fstat(fileno).st_size
+    except (AttributeError, io.UnsupportedOperation, OSError) as e:
+        raise socket._GiveupOnSendfile(e)
+    if not file_size:
+        return 0
+
+    block_size = min(count or file_size, 2 ** 30)
+    total_sent = 0
+    try:
+        while True:
+            if count:
+                block_size = min(count - total_sent, block_size)
+                if block_size <= 0:
+                    break
+            try:
+                sent = os.sendfile(sockno, fileno, offset, block_size)
+            except BlockingIOError:
+                wait_write(sockno, timeout=self.gettimeout())
+                continue
+            except OSError as e:
+                if total_sent == 0:
+                    raise socket._GiveupOnSendfile(e)
+                raise
+            if sent == 0:
+                break
+            offset += sent
+            total_sent += sent
+        return total_sent
+    finally:
+        if total_sent > 0 and hasattr(file, 'seek'):
+            file.seek(offset)
+
+
+def enable_gevent_sendfile(worker=None):
+    """gunicorn post_worker_init hook"""
+    from gevent import socket as gevent_socket
+    gevent_socket.socket.sendfile = _gevent_sendfile
+
+
+class WebApp(BaseApplication):
+    def __init__(self, options=None):
+        self.options = options or {}
+        super(WebApp, self).__init__()
+
+    def load_config(self):
+        config = dict([(key, value) for key, value in self.options.items()
+                       if key in self.cfg.settings and value is not None])
+        for key, value in config.items():
+            self.cfg.set(key.lower(), value)
+
+    def load(self):
+        return util.import_app("cc_container_worker.data_container.wsgi")
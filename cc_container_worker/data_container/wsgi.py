@@ -1,8 +1,15 @@
 import json
+import os
+from threading import Thread
 
-from flask import Flask, send_from_directory
+from flask import Flask, Response, request
+from prometheus_client import CONTENT_TYPE_LATEST
 
 from cc_container_worker.commons.data import FILES_INFO_PATH
+from cc_container_worker.data_container import lazy
+from cc_container_worker.data_container import memory
+from cc_container_worker.data_container import metrics
+from cc_container_worker.data_container.serving import send_file, send_stream
 
 application = Flask('data-container')
 
@@ -11,11 +18,41 @@ with open(FILES_INFO_PATH) as f:
     files = json.load(f)
 
 
-@application.route('/<key>', methods=['GET'])
+memory_tier = memory.load_settings()
+if memory_tier:
+    tier = memory.MemoryTier(
+        files,
+        max_size=memory_tier.get('max_size'),
+        max_file_size=memory_tier.get('max_file_size'),
+        hot_keys=memory_tier.get('hot_keys')
+    )
+    application.wsgi_app = memory.MemoryTierMiddleware(application.wsgi_app, tier, metrics.observe_memory_tier)
+
+application.wsgi_app = metrics.MetricsMiddleware(application.wsgi_app, files)
+
+prefetch_files = [file for file in files.values() if file.get('fetch') and file['fetch']['prefetch']]
+if prefetch_files:
+    Thread(target=lazy.prefetch, args=(prefetch_files,), daemon=True).start()
+
+
+@application.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.generate(files), content_type=CONTENT_TYPE_LATEST)
+
+
+@application.route('/<key>', methods=['GET', 'HEAD'])
 def root(key):
     file = files[key]
-    return send_from_directory(
-        file['local_input_file']['dir'],
-        file['local_input_file']['name'],
-        as_attachment=True
+    if file.get('fetch'):
+        if request.method == 'HEAD' or request.range is not None:
+            # the size and the byte positions are known when the download is complete
+            lazy.wait(file)
+        else:
+            blocks = lazy.stream(file)
+            if blocks is not None:
+                return send_stream(blocks, file['local_input_file']['name'])
+    return send_file(
+        request,
+        os.path.join(file['local_input_file']['dir'], file['local_input_file']['name']),
+        file['local_input_file']['name']
     )
@@ -1,11 +1,17 @@
 import sys
 import json
-import requests
+from urllib.error import HTTPError
+from urllib.request import urlopen
 
 
 def main():
     settings = json.loads(sys.argv[1])
-    requests.get(settings['inspection_url'])
+    # urllib instead of requests, importing requests takes longer than the request itself
+    try:
+        urlopen(settings['inspection_url']).close()
+    except HTTPError:
+        # like requests, an error status is not an error of the inspection container
+        pass
 
 
 if __name__ == '__main__':
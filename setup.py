@@ -42,6 +42,7 @@ setup(
         'gunicorn',
         'gevent',
         'psutil',
-        'paramiko'
+        'paramiko>=3.3',
+        'prometheus_client'
     ]
 )
@@ -0,0 +1,115 @@
+import json
+import socket
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+import pytest
+import requests
+from urllib3.util import connection
+
+from cc_container_worker.commons.callbacks import CallbackHandler
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        callback = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.received.append(callback['callback_type'])
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        body = json.dumps({'task_id': 'task'}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.received = []
+    server.statuses = []
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _callback_handler(port, max_retries=2):
+    settings = {
+        'callback_key': 'key',
+        'container_id': 'container',
+        'callback_url': 'http://127.0.0.1:{}/callback'.format(port),
+        'callback_max_retries': max_retries,
+        'callback_backoff_factor': 0
+    }
+    return CallbackHandler(settings, container_type='application')
+
+
+def test_started_callback_returns_response(server):
+    callback_handler = _callback_handler(server.server_address[1])
+    assert callback_handler.send_callback('started', 'success', 'Container started.') == {'task_id': 'task'}
+
+
+def test_gateway_errors_are_retried(server):
+    server.statuses = [503, 502]
+    callback_handler = _callback_handler(server.server_address[1])
+    callback_handler.send_callback('started', 'success', 'Container started.')
+    assert server.received == [0, 0, 0]
+
+
+def test_retries_are_limited(server):
+    server.statuses = [503, 503, 503]
+    callback_handler = _callback_handler(server.server_address[1])
+    with pytest.raises(Exception):
+        callback_handler.send_callback('started', 'success', 'Container started.')
+    assert server.received == [0, 0, 0]
+
+
+def test_client_errors_are_not_retried(server):
+    server.statuses = [400]
+    callback_handler = _callback_handler(server.server_address[1])
+    with pytest.raises(Exception):
+        callback_handler.send_callback('started', 'success', 'Container started.')
+    assert server.received == [0]
+
+
+def test_queued_callbacks_are_delivered_in_order(server):
+    callback_handler = _callback_handler(server.server_address[1])
+    callback_handler.send_callback('files_retrieved', 'success', 'Input files retrieved.')
+    callback_handler.send_callback('processed', 'success', 'Processing succeeded.')
+    callback_handler.send_callback('results_sent', 'success', 'Result files sent.')
+    callback_handler.flush()
+    assert server.received == [1, 2, 3]
+
+
+def test_failed_delivery_is_raised_by_the_next_callback(server):
+    server.statuses = [503, 503]
+    callback_handler = _callback_handler(server.server_address[1], max_retries=1)
+    callback_handler.send_callback('files_retrieved', 'success', 'Input files retrieved.')
+    with pytest.raises(Exception) as e:
+        callback_handler.send_callback('started', 'success', 'Container ready for the next task.')
+    assert 'Could not deliver callback' in str(e.value)
+    assert server.received == [1, 1]
+
+
+def test_connection_errors_are_only_retried_by_the_handler(monkeypatch):
+    # a port without server refuses the connections
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+
+    attempts = []
+    create_connection = connection.create_connection
+
+    def counting_create_connection(*args, **kwargs):
+        attempts.append(args[0])
+        return create_connection(*args, **kwargs)
+
+    monkeypatch.setattr(connection, 'create_connection', counting_create_connection)
+    with pytest.raises(requests.ConnectionError):
+        _callback_handler(port).send_callback('started', 'success', 'Container started.')
+    assert len(attempts) == 3
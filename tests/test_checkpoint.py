@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+import pytest
+from requests.exceptions import HTTPError
+
+from cc_container_worker.commons.checksums import Checksum
+from cc_container_worker.commons import downloaders
+from cc_container_worker.commons.downloaders import _Checkpoint, CHECKPOINT_SUFFIX, PART_SUFFIX
+
+SOURCE = 'http://example.org/file'
+DATA = bytes(range(256)) * 40
+
+
+def _download(checkpoint, segment, data):
+    """Writes data at the position of the segment, like the connectors do."""
+    with open(checkpoint.part_path, 'r+b') as f:
+        f.seek(segment[2])
+        f.write(data)
+    checkpoint.advance(segment, data)
+
+
+def _partial_download(local_file_path, num_bytes):
+    checkpoint = _Checkpoint(local_file_path, SOURCE)
+    checkpoint.start('etag', len(DATA), [[0, len(DATA) - 1, 0]])
+    _download(checkpoint, checkpoint.state['segments'][0], DATA[:num_bytes])
+    checkpoint.save()
+    return checkpoint
+
+
+def test_resume(tmp_path):
+    local_file_path = str(tmp_path / 'file')
+    _partial_download(local_file_path, 1000)
+
+    checkpoint = _Checkpoint(local_file_path, SOURCE)
+    assert checkpoint.state['validator'] == 'etag'
+    assert checkpoint.state['segments'] == [[0, len(DATA) - 1, 1000]]
+    assert checkpoint.resumed_bytes == 1000
+
+    segment = checkpoint.state['segments'][0]
+    _download(checkpoint, segment, DATA[1000:])
+    checkpoint.finish()
+    with open(local_file_path, 'rb') as f:
+        assert f.read() == DATA
+    assert not os.path.exists(local_file_path + PART_SUFFIX)
+    assert not os.path.exists(local_file_path + CHECKPOINT_SUFFIX)
+
+
+def test_retries_count_resumed_bytes_once(tmp_path):
+    local_file_path = str(tmp_path / 'file')
+    _partial_download(local_file_path, 1000)
+
+    checkpoint = _Checkpoint(local_file_path, SOURCE)
+    segment = checkpoint.state['segments'][0]
+    _download(checkpoint, segment, DATA[1000:1500])
+    checkpoint.resume()
+    assert checkpoint.resumed_bytes == 1500
+    # a retry without progress
+    checkpoint.resume()
+    assert checkpoint.resumed_bytes == 1500
+
+
+def test_resume_verifies_checksum(tmp_path):
+    local_file_path = str(tmp_path / 'file')
+    _partial_download(local_file_path, 1000)
+
+    checksum = Checksum('sha256:' + hashlib.sha256(DATA).hexdigest())
+    checkpoint = _Checkpoint(local_file_path, SOURCE, checksum)
+    segment = checkpoint.state['segments'][0]
+    # the bytes of the earlier run are read back from the partial file
+    checkpoint.prepare_checksum(segment)
+    _download(checkpoint, segment, DATA[1000:])
+    checkpoint.verify()
+    assert checkpoint.stream_checksum.inline_bytes == len(DATA) - 1000
+
+
+def test_other_source_starts_over(tmp_path):
+    local_file_path = str(tmp_path / 'file')
+    _partial_download(local_file_path, 1000)
+
+    checkpoint = _Checkpoint(local_file_path, 'http://example.org/other')
+    assert checkpoint.state['segments'] == []
+    assert checkpoint.resumed_bytes == 0
+
+
+def test_missing_part_file_starts_over(tmp_path):
+    local_file_path = str(tmp_path / 'file')
+    _partial_download(local_file_path, 1000)
+    os.remove(local_file_path + PART_SUFFIX)
+
+    checkpoint = _Checkpoint(local_file_path, SOURCE)
+    assert checkpoint.state['segments'] == []
+
+
+def test_restart_segment(tmp_path):
+    local_file_path = str(tmp_path / 'file')
+    checkpoint = _partial_download(local_file_path, 1000)
+    segment = checkpoint.state['segments'][0]
+
+    # e.g. the server sent the complete file instead of the requested range
+    checkpoint.restart(segment)
+    assert segment == [0, len(DATA) - 1, 0]
+    assert checkpoint.refetched_bytes == 1000
+
+
+def test_reset(tmp_path):
+    local_file_path = str(tmp_path / 'file')
+    checkpoint = _partial_download(local_file_path, 1000)
+
+    # e.g. the source changed
+    checkpoint.reset()
+    assert checkpoint.state['segments'] == []
+    assert checkpoint.refetched_bytes == 1000
+
+    with open(local_file_path + CHECKPOINT_SUFFIX) as f:
+        assert json.load(f)['segments'] == [[0, len(DATA) - 1, 1000]]
+    checkpoint.save()
+    # an empty state is not saved, the old checkpoint is replaced by the next start
+    checkpoint.start('etag', len(DATA), [[0, len(DATA) - 1, 0]])
+    assert _Checkpoint(local_file_path, SOURCE).resumed_bytes == 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Answers range requests for DATA, or 404 for other paths."""
+    def do_GET(self):
+        if self.path != '/file':
+            self.send_error(404)
+            return
+        self.server.ranges.append(self.headers.get('Range'))
+        first, last = 0, len(DATA) - 1
+        if self.headers.get('Range'):
+            first, _, last = self.headers['Range'][len('bytes='):].partition('-')
+            first, last = int(first), min(int(last or len(DATA) - 1), len(DATA) - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(first, last, len(DATA)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(last + 1 - first))
+        self.send_header('ETag', '"etag"')
+        self.end_headers()
+        self.wfile.write(DATA[first:last + 1])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.ranges = []
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_failed_probe_leaves_no_files(tmp_path, server):
+    url = 'http://127.0.0.1:{}/missing'.format(server.server_address[1])
+    with pytest.raises(HTTPError):
+        downloaders.http({'url': url}, {'dir': str(tmp_path), 'name': 'file'})
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_download_with_checksum_uses_one_connection(tmp_path, server, monkeypatch):
+    monkeypatch.setattr(downloaders, 'MIN_SEGMENT_SIZE', 1024)
+    url = 'http://127.0.0.1:{}/file'.format(server.server_address[1])
+    connector_access = {'url': url, 'max_connections': 4}
+    downloaders.http(connector_access, {'dir': str(tmp_path), 'name': 'segmented'})
+    assert len(server.ranges) == 5
+
+    server.ranges.clear()
+    connector_access['checksum'] = 'sha256:' + hashlib.sha256(DATA).hexdigest()
+    downloaders.http(connector_access, {'dir': str(tmp_path), 'name': 'file'})
+    assert server.ranges == ['bytes=0-0', 'bytes=0-{}'.format(len(DATA) - 1)]
+    with open(str(tmp_path / 'file'), 'rb') as f:
+        assert f.read() == DATA
@@ -0,0 +1,48 @@
+import gzip
+import os
+
+import pytest
+
+from cc_container_worker.commons import compression
+from cc_container_worker.commons.compression import Decompressor, GZIP, ZSTD, LZ4
+
+MEMBERS = [os.urandom(1000) + b'a' * 50000, b'', b'b' * 3000, os.urandom(70000)]
+
+
+def _compress(algorithm, data):
+    if algorithm == ZSTD:
+        pytest.importorskip('zstandard')
+    elif algorithm == LZ4:
+        pytest.importorskip('lz4.frame')
+    return b''.join(compression.compress_blocks([data], algorithm))
+
+
+def _decompress(algorithm, data, block_size):
+    d = Decompressor(algorithm)
+    result = b''.join(d.decompress(data[i:i + block_size]) for i in range(0, len(data), block_size))
+    d.finish()
+    return d, result
+
+
+@pytest.mark.parametrize('algorithm', [GZIP, ZSTD, LZ4])
+@pytest.mark.parametrize('block_size', [1, 7, 4096, 1024 * 1024])
+def test_multiple_members(algorithm, block_size):
+    compressed = b''.join(_compress(algorithm, member) for member in MEMBERS)
+    d, result = _decompress(algorithm, compressed, block_size)
+    assert result == b''.join(MEMBERS)
+    assert d.num_bytes == len(result)
+    assert d.compressed_bytes == len(compressed)
+
+
+def test_members_of_other_compressors():
+    # e.g. concatenated files of gzip or bgzip
+    compressed = b''.join(gzip.compress(member) for member in MEMBERS)
+    _, result = _decompress(GZIP, compressed, 4096)
+    assert result == b''.join(MEMBERS)
+
+
+@pytest.mark.parametrize('algorithm', [GZIP, ZSTD, LZ4])
+def test_truncated_member(algorithm):
+    compressed = _compress(algorithm, MEMBERS[0]) + _compress(algorithm, MEMBERS[3])
+    with pytest.raises(Exception, match='truncated'):
+        _decompress(algorithm, compressed[:-10], 4096)
@@ -0,0 +1,49 @@
+import pytest
+
+from cc_container_worker.commons import connectors
+from cc_container_worker.commons.connectors import ConnectorRegistry, DOWNLOADERS, UPLOADERS
+
+
+class _EntryPoint:
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+        self.loaded = False
+
+    def load(self):
+        self.loaded = True
+        return self.func
+
+
+def _s3(connector_access, local_result_file, meta_data):
+    pass
+
+
+def test_built_in_types():
+    # functions imported by the connector modules are not connectors
+    assert DOWNLOADERS.types() == ['http', 'ssh']
+    assert UPLOADERS.types() == ['http', 'http_json', 'mongodb_gridfs', 'mongodb_json', 'ssh']
+
+
+def test_decorated_connectors_keep_their_attributes():
+    assert UPLOADERS['http'].stream is not None
+
+
+def test_unknown_type():
+    with pytest.raises(Exception, match='not supported'):
+        DOWNLOADERS.get('_with_retries')
+
+
+def test_entry_points(monkeypatch):
+    s3 = _EntryPoint('s3', _s3)
+    http = _EntryPoint('http', _s3)
+    monkeypatch.setattr(connectors, 'entry_points', lambda group: [s3, http] if group == 'test' else [])
+    registry = ConnectorRegistry('cc_container_worker.commons.uploaders', 'test')
+
+    assert registry.types() == ['http', 'http_json', 'mongodb_gridfs', 'mongodb_json', 's3', 'ssh']
+    # entry points are only loaded on request
+    assert not s3.loaded
+    assert registry['s3'] is _s3
+    assert s3.loaded
+    # and replace built-in connectors
+    assert registry['http'] is _s3
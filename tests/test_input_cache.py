@@ -0,0 +1,91 @@
+import os
+
+from cc_container_worker.commons import input_cache
+from cc_container_worker.commons.input_cache import InputCache, _cache_key, _locked
+
+DIGEST = 'sha256:' + '0' * 64
+
+
+def _input_file(url, checksum=None, **connector_access):
+    connector_access['url'] = url
+    if checksum:
+        connector_access['checksum'] = checksum
+    return {'connector_type': 'http', 'connector_access': connector_access}
+
+
+def _connector(calls, data=b'data'):
+    """Returns a fake connector, which records the downloaded urls."""
+    def connector(connector_access, local_input_file):
+        calls.append(connector_access['url'])
+        with open(os.path.join(local_input_file['dir'], local_input_file['name']), 'wb') as f:
+            f.write(data)
+    return connector
+
+
+def test_checksum_digest_identifies_file():
+    # the source does not matter if the content is known
+    assert _cache_key(_input_file('http://a/file', DIGEST)) == _cache_key(_input_file('http://b/file', DIGEST))
+    assert _cache_key(_input_file('http://a/file', DIGEST)) != _cache_key(
+        _input_file('http://a/file', DIGEST, decompress='gzip')
+    )
+
+
+def test_validator_identifies_file(monkeypatch):
+    validators = {'http://a/file': '"v1"', 'http://a/other': None}
+    monkeypatch.setattr(input_cache, '_http_validator', lambda connector_access: validators[connector_access['url']])
+
+    key = _cache_key(_input_file('http://a/file'))
+    # a checksum without digest does not identify the file
+    assert _cache_key(_input_file('http://a/file', 'sha256')) == key
+    validators['http://a/file'] = '"v2"'
+    assert _cache_key(_input_file('http://a/file')) != key
+    # files without validator are not cached
+    assert _cache_key(_input_file('http://a/other')) is None
+
+
+def test_fetch_hit_and_miss(tmp_path):
+    cache = InputCache(str(tmp_path / 'cache'))
+    calls = []
+    for name in ['a', 'b']:
+        cache.fetch(_connector(calls), _input_file('http://a/file', DIGEST), {'dir': str(tmp_path), 'name': name})
+        with open(str(tmp_path / name), 'rb') as f:
+            assert f.read() == b'data'
+    assert calls == ['http://a/file']
+
+
+def test_fetch_without_key_bypasses_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(input_cache, '_http_validator', lambda connector_access: None)
+    cache = InputCache(str(tmp_path / 'cache'))
+    calls = []
+    for name in ['a', 'b']:
+        cache.fetch(_connector(calls), _input_file('http://a/file'), {'dir': str(tmp_path), 'name': name})
+    assert calls == ['http://a/file', 'http://a/file']
+    assert os.listdir(cache.objects_dir) == []
+
+
+def _add_object(cache, name, size, mtime):
+    path = os.path.join(cache.objects_dir, name)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = InputCache(str(tmp_path / 'cache'), max_size=250)
+    _add_object(cache, 'old', 100, 1000)
+    _add_object(cache, 'used', 100, 3000)
+    new = _add_object(cache, 'new', 100, 2000)
+    cache.evict(keep=new)
+    assert sorted(os.listdir(cache.objects_dir)) == ['new', 'used']
+
+
+def test_evict_keeps_kept_and_locked_files(tmp_path):
+    cache = InputCache(str(tmp_path / 'cache'), max_size=150)
+    _add_object(cache, 'locked', 100, 1000)
+    kept = _add_object(cache, 'kept', 100, 2000)
+    _add_object(cache, 'other', 100, 3000)
+    # e.g. a concurrent container places the locked file
+    with _locked(os.path.join(cache.locks_dir, 'locked')):
+        cache.evict(keep=kept)
+    assert sorted(os.listdir(cache.objects_dir)) == ['kept', 'locked']
@@ -0,0 +1,78 @@
+import os
+from threading import Event
+from time import sleep
+
+import pytest
+
+from cc_container_worker.commons import streaming
+from cc_container_worker.data_container import lazy
+
+BLOCKS = [bytes([i]) * 1000 for i in range(5)]
+
+
+@pytest.fixture
+def file(tmp_path):
+    return {
+        'input_file': {'connector_type': 'http', 'connector_access': {'url': 'http://example.org/file'}},
+        'local_input_file': {'dir': str(tmp_path), 'name': 'file'}
+    }
+
+
+def _fake_stream(release=None, fail=False):
+    """Returns a replacement of streaming.stream, which appends BLOCKS to the growing file."""
+    def stream(connector, input_file, local_input_file):
+        file_path = os.path.join(local_input_file['dir'], local_input_file['name'])
+        with open(file_path, 'ab') as f:
+            for i, block in enumerate(BLOCKS):
+                f.write(block)
+                f.flush()
+                if i == 1 and release:
+                    # readers see the first blocks before the download is complete
+                    release.wait(5)
+                sleep(0.01)
+        if fail:
+            raise Exception('failed')
+        open(file_path + streaming.COMPLETE_SUFFIX, 'w').close()
+    return stream
+
+
+def test_complete_file_is_not_streamed(file, tmp_path):
+    with open(str(tmp_path / 'file'), 'wb') as f:
+        f.write(b''.join(BLOCKS))
+    assert lazy.stream(file) is None
+    assert lazy.start(file) is None
+
+
+def test_growing_file_is_read_while_downloading(file, tmp_path, monkeypatch):
+    release = Event()
+    monkeypatch.setattr(lazy.streaming, 'stream', _fake_stream(release))
+    blocks = lazy.stream(file)
+
+    data = b''
+    while len(data) < 2 * len(BLOCKS[0]):
+        data += next(blocks)
+    assert not os.path.exists(str(tmp_path / 'file'))
+    release.set()
+
+    data += b''.join(blocks)
+    assert data == b''.join(BLOCKS)
+    with open(str(tmp_path / 'file'), 'rb') as f:
+        assert f.read() == data
+    assert not os.path.exists(str(tmp_path / 'file') + lazy.FETCH_SUFFIX)
+
+
+def test_concurrent_requests_share_one_download(file, monkeypatch):
+    calls = []
+    fake_stream = _fake_stream()
+    monkeypatch.setattr(lazy.streaming, 'stream', lambda *args: calls.append(args) or fake_stream(*args))
+    readers = [lazy.stream(file) for _ in range(3)]
+    assert [b''.join(blocks) for blocks in readers] == [b''.join(BLOCKS)] * 3
+    assert len(calls) == 1
+
+
+def test_failed_download_is_raised_by_readers(file, tmp_path, monkeypatch):
+    monkeypatch.setattr(lazy.streaming, 'stream', _fake_stream(fail=True))
+    with pytest.raises(Exception) as e:
+        lazy.wait(file)
+    assert 'Download of' in str(e.value)
+    assert not os.path.exists(str(tmp_path / 'file'))
@@ -0,0 +1,142 @@
+from threading import Event, Lock
+from time import monotonic, sleep
+
+import pytest
+
+from cc_container_worker.commons import scheduler
+from cc_container_worker.commons.scheduler import TransferScheduler, TransferError, check_cancelled
+
+
+def _fail():
+    raise ValueError('failed')
+
+
+def _run_until_cancelled(started=None, seconds=10):
+    if started:
+        started.set()
+    end = monotonic() + seconds
+    while monotonic() < end:
+        check_cancelled()
+        sleep(0.01)
+
+
+def test_wait_returns_results():
+    with TransferScheduler(max_workers=2) as s:
+        futures = [s.submit('a', None, lambda: 1), s.submit('b', None, lambda: 2)]
+        s.wait()
+    assert [f.result() for f in futures] == [1, 2]
+
+
+def test_failure_cancels_queued_transfers():
+    with TransferScheduler(max_workers=1) as s:
+        s.submit('a', None, _fail)
+        # cancelled before or after it started
+        s.submit('b', None, _run_until_cancelled)
+        with pytest.raises(TransferError) as e:
+            s.wait()
+    assert [error['name'] for error in e.value.errors] == ['a']
+    assert isinstance(e.value.exceptions[0], ValueError)
+    assert e.value.cancelled == ['b']
+
+
+def test_failure_cancels_running_transfers():
+    started = Event()
+    start = monotonic()
+    with TransferScheduler(max_workers=2) as s:
+        s.submit('a', None, _run_until_cancelled, started)
+        started.wait(5)
+        s.submit('b', None, _fail)
+        with pytest.raises(TransferError) as e:
+            s.wait()
+    assert monotonic() - start < 5
+    assert [error['name'] for error in e.value.errors] == ['b']
+    assert e.value.cancelled == ['a']
+
+
+def test_nested_transfers_are_cancelled_with_their_parent():
+    started = Event()
+
+    def download():
+        with TransferScheduler(max_workers=2) as segments:
+            segments.submit('segment 0', None, _run_until_cancelled, started)
+            segments.submit('segment 1', None, _run_until_cancelled)
+            segments.wait()
+
+    start = monotonic()
+    with TransferScheduler(max_workers=2) as s:
+        s.submit('a', None, download)
+        started.wait(5)
+        s.submit('b', None, _fail)
+        with pytest.raises(TransferError) as e:
+            s.wait()
+    assert monotonic() - start < 5
+    assert [error['name'] for error in e.value.errors] == ['b']
+    assert e.value.cancelled == ['a']
+
+
+def test_blocked_transfers_are_abandoned(monkeypatch):
+    monkeypatch.setattr(scheduler, 'CANCEL_GRACE_SECONDS', 0.1)
+    release = Event()
+    started = Event()
+    start = monotonic()
+    try:
+        with TransferScheduler(max_workers=2) as s:
+            s.submit('a', None, lambda: started.set() or release.wait(10))
+            started.wait(5)
+            s.submit('b', None, _fail)
+            with pytest.raises(TransferError) as e:
+                s.wait()
+        assert monotonic() - start < 5
+        assert e.value.cancelled == ['a']
+    finally:
+        release.set()
+
+
+def test_failure_only_cancels_its_group():
+    started = Event()
+    with TransferScheduler(max_workers=2) as s:
+        other = s.submit('a', None, lambda: started.wait(5) and 'done')
+        group = [s.submit('b', None, _fail)]
+        with pytest.raises(TransferError):
+            s.wait(group)
+        started.set()
+        s.wait([other])
+    assert other.result() == 'done'
+
+
+def test_transfers_per_key_are_limited():
+    lock = Lock()
+    running = {'now': 0, 'max': 0}
+
+    def transfer():
+        with lock:
+            running['now'] += 1
+            running['max'] = max(running['max'], running['now'])
+        sleep(0.05)
+        with lock:
+            running['now'] -= 1
+
+    with TransferScheduler(max_workers=4, max_workers_per_key={'host': 2}) as s:
+        for i in range(6):
+            s.submit(str(i), 'host', transfer)
+        s.wait()
+    assert running['max'] == 2
+
+
+def test_limited_keys_do_not_block_other_keys():
+    finished = {}
+
+    def transfer(name):
+        sleep(0.2)
+        finished[name] = monotonic() - start
+
+    start = monotonic()
+    with TransferScheduler(max_workers=8, max_workers_per_key=4) as s:
+        for i in range(12):
+            s.submit('a{}'.format(i), 'a', transfer, 'a{}'.format(i))
+        for i in range(4):
+            s.submit('b{}'.format(i), 'b', transfer, 'b{}'.format(i))
+        s.wait()
+    # the queued transfers of host a do not occupy the threads needed by host b
+    assert max(finished['b{}'.format(i)] for i in range(4)) < 0.35
+    assert max(finished.values()) < 0.75
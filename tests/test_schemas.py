@@ -0,0 +1,45 @@
+import jsonschema
+import pytest
+
+from cc_container_worker.commons.schemas import application_config_schema, validate_application_config
+from cc_container_worker.commons.schemas import _compile, _is_valid_application_config
+
+VALID = {
+    'application_command': 'app',
+    'local_input_files': [{'dir': '/tmp', 'name': 'a'}],
+    'local_result_files': {'result_1': {'dir': '/tmp', 'name': 'b'}}
+}
+
+CONFIGS = [
+    VALID,
+    dict(VALID, local_input_files=[], local_result_files={}),
+    dict(VALID, application_command=1),
+    dict(VALID, application_command=None),
+    dict(VALID, local_input_files={}),
+    dict(VALID, local_input_files=['a']),
+    dict(VALID, local_result_files=[]),
+    dict(VALID, local_result_files={'result 1': {}}),
+    dict(VALID, local_result_files={'result_1': 'b'}),
+    dict(VALID, other=True),
+    {key: value for key, value in VALID.items() if key != 'local_result_files'},
+    [],
+    None
+]
+
+
+@pytest.mark.parametrize('config', CONFIGS)
+def test_compiled_validator_matches_jsonschema(config):
+    validator = jsonschema.validators.validator_for(application_config_schema)(application_config_schema)
+    assert _is_valid_application_config(config) == validator.is_valid(config)
+
+
+def test_invalid_config_is_described_by_jsonschema():
+    validate_application_config(VALID)
+    with pytest.raises(jsonschema.ValidationError):
+        validate_application_config(dict(VALID, other=True))
+
+
+def test_unsupported_keywords_are_not_compiled():
+    assert _compile({'type': 'integer'}) is None
+    assert _compile({'type': 'object', 'properties': {'a': {'minLength': 1}}}) is None
+    assert _compile({'type': 'array', 'items': {'type': 'string'}}) is not None
@@ -0,0 +1,87 @@
+import pytest
+from flask import Flask, request
+from werkzeug.wsgi import FileWrapper
+
+from cc_container_worker.data_container.serving import send_file
+
+DATA = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def client(tmp_path):
+    file_path = str(tmp_path / 'file')
+    with open(file_path, 'wb') as f:
+        f.write(DATA)
+
+    app = Flask('test')
+
+    @app.route('/file', methods=['GET', 'HEAD'])
+    def root():
+        return send_file(request, file_path, 'file')
+
+    return app.test_client()
+
+
+def test_get(client):
+    r = client.get('/file')
+    assert r.status_code == 200
+    assert r.data == DATA
+    assert r.headers['Accept-Ranges'] == 'bytes'
+    assert r.headers['Content-Length'] == str(len(DATA))
+
+
+def test_head(client):
+    r = client.head('/file')
+    assert r.status_code == 200
+    assert r.data == b''
+    assert r.headers['Content-Length'] == str(len(DATA))
+
+
+def test_range(client):
+    r = client.get('/file', headers={'Range': 'bytes=100-199'})
+    assert r.status_code == 206
+    assert r.data == DATA[100:200]
+    assert r.headers['Content-Range'] == 'bytes 100-199/{}'.format(len(DATA))
+    assert r.headers['Content-Length'] == '100'
+
+
+def test_suffix_range(client):
+    r = client.get('/file', headers={'Range': 'bytes=-24'})
+    assert r.status_code == 206
+    assert r.data == DATA[-24:]
+
+
+def test_range_with_file_wrapper(client):
+    # the file wrapper starts at the range, the server stops after Content-Length bytes
+    r = client.get('/file', headers={'Range': 'bytes=1000-'}, environ_overrides={'wsgi.file_wrapper': FileWrapper})
+    assert r.status_code == 206
+    assert r.data == DATA[1000:]
+
+
+def test_unsatisfiable_range(client):
+    r = client.get('/file', headers={'Range': 'bytes={}-'.format(len(DATA))})
+    assert r.status_code == 416
+    assert r.headers['Content-Range'] == 'bytes */{}'.format(len(DATA))
+
+
+def test_if_range(client):
+    etag = client.head('/file').headers['ETag']
+    r = client.get('/file', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert r.status_code == 206
+    assert r.data == DATA[:10]
+
+    # the file changed, the complete file is sent
+    r = client.get('/file', headers={'Range': 'bytes=0-9', 'If-Range': '"other"'})
+    assert r.status_code == 200
+    assert r.data == DATA
+
+
+def test_not_modified(client):
+    headers = client.head('/file').headers
+    r = client.get('/file', headers={'If-None-Match': headers['ETag']})
+    assert r.status_code == 304
+    assert r.data == b''
+    r = client.get('/file', headers={'If-Modified-Since': headers['Last-Modified']})
+    assert r.status_code == 304
+    r = client.get('/file', headers={'If-None-Match': '"other"'})
+    assert r.status_code == 200
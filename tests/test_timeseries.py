@@ -0,0 +1,29 @@
+from cc_container_worker.application_container.timeseries import TimeSeries, COUNTER, GAUGE, decode
+
+FIELDS = [('time_ms', COUNTER), ('rss_memory', GAUGE), ('delta', GAUGE)]
+
+
+def test_encode_decode_round_trip():
+    series = TimeSeries(FIELDS)
+    rows = [[i * 100, (i * 7919) % 5000 * 1024 * 1024, (-1) ** i * i * 1000003] for i in range(500)]
+    for row in rows:
+        series.append(row)
+
+    encoded = series.encode()
+    assert encoded['fields'] == ['time_ms', 'rss_memory', 'delta']
+    assert encoded['count'] == len(rows)
+    assert decode(encoded) == rows
+
+
+def test_encode_decode_empty():
+    assert decode(TimeSeries(FIELDS).encode()) == []
+
+
+def test_downsampling_keeps_counters_and_peaks():
+    series = TimeSeries(FIELDS, max_samples=4)
+    for i in range(9):
+        series.append([i, 100 if i == 3 else i, 0])
+
+    # the last value of counters and the maximum of gauges are kept
+    assert decode(series.encode()) == [[3, 100, 0], [7, 7, 0], [8, 8, 0]]
+    assert series.stride == 4